@@ -3,10 +3,38 @@ import yaml
 from yaml.loader import SafeLoader
 import streamlit_authenticator as stauth
 import pandas as pd
+import numpy as np
 import io
 import os
+import stat
+import atexit
+import copy
+import datetime
+import graphlib
+import hashlib
+import inspect
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import bcrypt  # Para hashear contraseñas manualmente
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
+
+# Cálculos, almacén y consolidado (sin Streamlit: también los usa el recálculo
+# por línea de comandos, ver presupuesto_nucleo.main)
+from presupuesto_nucleo import (
+    AREAS_IMPUTACION, BACKEND_ALMACEN, DIARIO_DIR, ESQUEMAS_CALCULO, EXCEL_FILE,
+    FILAS_DESTACADAS_INICIALES, HOJAS_ACTUALIZACION, HOJAS_EXCEL, METAS_SECCION,
+    SQLITE_FILE, TABLAS_TOTALES,
+    AlmacenSQLite, CacheLRU, ConflictoVersionError, DiarioCambios, MotorConsolidado,
+    aplicar_filas, bloqueo_archivo, calcular_matriz_totales, cambios_tablas,
+    cargar_tablas, conciliar_actualizacion, crear_almacen, evaluar_esquema,
+    exportar_a_excel, huella_contenido, huella_exacta, importar_desde_excel,
+    metas_desde_tabla, total_matriz,
+)
 
 
 ########################################
@@ -22,17 +50,207 @@ def cargar_config_desde_yaml(ruta_yaml="config.yaml"):
     with open(ruta_yaml, "r", encoding="utf-8") as file:
         return yaml.load(file, Loader=SafeLoader)
 
+def _modo_archivo(ruta: str) -> int:
+    """Permisos de 'ruta' si existe; si no, 0644 menos la umask del proceso."""
+    try:
+        return stat.S_IMODE(os.stat(ruta).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o644 & ~umask
+
+
 def guardar_config_a_yaml(config: dict, ruta_yaml="config.yaml"):
     """
     Sobrescribe config.yaml con el dict 'config'.
+    Escribe en un archivo temporal y lo renombra (os.replace): un lector ve
+    el archivo anterior o el nuevo completo, nunca uno a medio escribir.
+    El archivo conserva sus permisos (mkstemp crea el temporal con 0600).
+    """
+    directorio = os.path.dirname(os.path.abspath(ruta_yaml))
+    fd, ruta_tmp = tempfile.mkstemp(prefix=".tmp_", suffix=".yaml", dir=directorio)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            yaml.dump(config, file, default_flow_style=False)
+        os.chmod(ruta_tmp, _modo_archivo(ruta_yaml))
+        os.replace(ruta_tmp, ruta_yaml)
+    except BaseException:
+        os.remove(ruta_tmp)
+        raise
+
+
+@st.cache_resource
+def _cache_config(ruta_yaml: str) -> dict:
+    """Config parseada compartida por el proceso (ver obtener_config)."""
+    return {"lock": threading.Lock(), "firma": None, "version": None, "config": None}
+
+
+def obtener_config(ruta_yaml="config.yaml") -> tuple[dict, str]:
     """
-    with open(ruta_yaml, "w", encoding="utf-8") as file:
-        yaml.dump(config, file, default_flow_style=False)
+    Retorna (config, version) desde la memoria del proceso. El archivo solo se
+    vuelve a leer si cambió su mtime o tamaño, y solo se vuelve a parsear si
+    cambió su contenido (version = hash del archivo).
+    La config retornada es compartida: no se debe modificar.
+    """
+    cache = _cache_config(os.path.abspath(ruta_yaml))
+    try:
+        estado = os.stat(ruta_yaml)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"No se encontró el archivo {ruta_yaml}")
+    firma = (estado.st_mtime_ns, estado.st_size)
+    with cache["lock"]:
+        if cache["firma"] != firma:
+            with open(ruta_yaml, "rb") as file:
+                contenido = file.read()
+            version = hashlib.blake2b(contenido, digest_size=16).hexdigest()
+            if version != cache["version"]:
+                cache["config"] = yaml.load(contenido.decode("utf-8"), Loader=SafeLoader)
+                cache["version"] = version
+            cache["firma"] = firma
+        return cache["config"], cache["version"]
+
+
+def obtener_autenticador(ruta_yaml="config.yaml"):
+    """
+    Retorna (authenticator, config). Se crea un stauth.Authenticate por sesión
+    y versión de la config, y se reutiliza mientras el usuario siga logueado.
+    No se comparte entre sesiones: guarda el estado de la cookie del navegador
+    y modifica sus credenciales al hacer login (por eso recibe una copia).
+    Mientras no hay sesión iniciada se recrea en cada ejecución, para que el
+    componente de cookies pueda leer la cookie de re-autenticación.
+    """
+    config, version = obtener_config(ruta_yaml)
+    previo = st.session_state.get("_autenticador")
+    if (previo is not None and previo["version"] == version
+            and st.session_state.get("authentication_status") is True):
+        return previo["authenticator"], config
+    authenticator = stauth.Authenticate(
+        copy.deepcopy(config['credentials']),
+        config['cookie']['name'],
+        config['cookie']['key'],
+        config['cookie']['expiry_days']
+    )
+    st.session_state["_autenticador"] = {"version": version, "authenticator": authenticator}
+    return authenticator, config
 
 
 ########################################
 # 2) Registro de nuevos usuarios
 ########################################
+# Costo de bcrypt (log2 de las rondas) y tamaño del pool de hash.
+# bcrypt libera el GIL: el pool acota cuántos hash corren a la vez en el proceso.
+BCRYPT_RONDAS = int(os.environ.get("PRESUPUESTO_BCRYPT_RONDAS", "12"))
+BCRYPT_HILOS  = int(os.environ.get("PRESUPUESTO_BCRYPT_HILOS", "4"))
+
+ROLES_USUARIO = ["admin","editor","viewer"]
+AREAS_USUARIO = ["PRE","VPD","VPO","VPF","VPE"]
+
+
+class MetricasHash:
+    """Latencias de bcrypt por operación ('hash', 'verificacion'), en segundos."""
+
+    def __init__(self, muestras: int=500):
+        self._lock = threading.Lock()
+        self._latencias = {}
+        self._muestras = muestras
+
+    def registrar(self, operacion: str, segundos: float):
+        with self._lock:
+            self._latencias.setdefault(operacion, deque(maxlen=self._muestras)).append(segundos)
+
+    def resumen(self) -> pd.DataFrame:
+        """Cantidad, promedio, p95 y máximo (ms) de las últimas muestras por operación."""
+        with self._lock:
+            datos = {op: np.array(lat) * 1000 for op, lat in self._latencias.items()}
+        return pd.DataFrame(
+            [
+                {"operacion": op, "muestras": len(ms), "promedio_ms": ms.mean(),
+                 "p95_ms": np.percentile(ms, 95), "max_ms": ms.max()}
+                for op, ms in datos.items()
+            ],
+            columns=["operacion","muestras","promedio_ms","p95_ms","max_ms"],
+        )
+
+
+@st.cache_resource
+def obtener_pool_bcrypt():
+    """Pool acotado de hilos para bcrypt y sus métricas, únicos por proceso."""
+    return {
+        "pool": ThreadPoolExecutor(max_workers=BCRYPT_HILOS, thread_name_prefix="bcrypt"),
+        "metricas": MetricasHash(),
+    }
+
+
+def _medir(operacion: str, fn, *args):
+    inicio = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        obtener_pool_bcrypt()["metricas"].registrar(operacion, time.perf_counter() - inicio)
+
+
+def _hashear(password_plano: str) -> str:
+    salt = bcrypt.gensalt(rounds=BCRYPT_RONDAS)
+    return bcrypt.hashpw(password_plano.encode("utf-8"), salt).decode("utf-8")
+
+
+def _verificar(password_plano: str, hashed_pass: str) -> bool:
+    return bcrypt.checkpw(password_plano.encode("utf-8"), hashed_pass.encode("utf-8"))
+
+
+def hashear_passwords(passwords: list) -> list:
+    """Hashea las contraseñas en paralelo en el pool de bcrypt (mismo orden)."""
+    pool = obtener_pool_bcrypt()["pool"]
+    return list(pool.map(lambda pw: _medir("hash", _hashear, pw), passwords))
+
+
+def hashear_password(password_plano: str) -> str:
+    """Hash bcrypt de una contraseña, calculado en el pool de bcrypt."""
+    return hashear_passwords([password_plano])[0]
+
+
+def verificar_password(password_plano: str, hashed_pass: str) -> bool:
+    """Verifica una contraseña contra su hash bcrypt en el pool de bcrypt."""
+    pool = obtener_pool_bcrypt()["pool"]
+    return pool.submit(_medir, "verificacion", _verificar, password_plano, hashed_pass).result()
+
+
+def _check_pw_compatible() -> bool:
+    """True si stauth.Hasher.check_pw existe con la firma (password, hashed_password)."""
+    check_pw = getattr(stauth.Hasher, "check_pw", None)
+    if not callable(check_pw):
+        return False
+    try:
+        return list(inspect.signature(check_pw).parameters) == ["password", "hashed_password"]
+    except (TypeError, ValueError):
+        return False
+
+
+# El login de streamlit_authenticator (versión fijada en requirements.txt)
+# verifica con Hasher.check_pw: se deriva al pool para que los logins
+# simultáneos no saturen el proceso. Si otra versión no tiene ese método con
+# esa firma, se deja el de la librería (verifica sin pasar por el pool).
+if _check_pw_compatible():
+    stauth.Hasher.check_pw = classmethod(lambda cls, password, hashed_password: verificar_password(password, hashed_password))
+
+
+def _agregar_usuarios_a_config(nuevos: dict, ruta_yaml="config.yaml") -> list:
+    """
+    Agrega los usuarios 'nuevos' (username -> datos, con la contraseña ya hasheada)
+    a config.yaml con una sola escritura, bajo bloqueo: registros simultáneos
+    no se pisan. Retorna los usernames omitidos porque ya existían.
+    """
+    with bloqueo_archivo(ruta_yaml + ".lock"):
+        config = cargar_config_desde_yaml(ruta_yaml)
+        usuarios = config["credentials"]["usernames"]
+        omitidos = [u for u in nuevos if u in usuarios]
+        agregar = {u: datos for u, datos in nuevos.items() if u not in usuarios}
+        if agregar:
+            usuarios.update(agregar)
+            guardar_config_a_yaml(config, ruta_yaml)
+    return omitidos
+
+
 def registrar_nuevo_usuario(
     username,
     first_name,
@@ -50,18 +268,15 @@ def registrar_nuevo_usuario(
      - Usa el área 'area_asignada' (VPD, VPO, VPF, VPE, PRE)
     Retorna (exito: bool, mensaje: str).
     """
-    config = cargar_config_desde_yaml(ruta_yaml)
-
-    # Verificar si el usuario ya existe
+    # Verificación rápida sin bloqueo (se repite bajo el bloqueo)
+    config, _ = obtener_config(ruta_yaml)
     if username in config["credentials"]["usernames"]:
         return False, f"El usuario '{username}' ya existe."
 
-    # Hashear la contraseña con bcrypt
-    hashed_bytes = bcrypt.hashpw(password_plano.encode("utf-8"), bcrypt.gensalt())
-    hashed_pass  = hashed_bytes.decode("utf-8")
+    # Hashear la contraseña con bcrypt (en el pool, fuera del bloqueo)
+    hashed_pass = hashear_password(password_plano)
 
-    # Agregar al diccionario de usuarios en la config
-    config["credentials"]["usernames"][username] = {
+    nuevo = {
         "first_name": first_name,
         "last_name":  last_name,
         "email":      email,
@@ -69,11 +284,79 @@ def registrar_nuevo_usuario(
         "role":       role_asignado,
         "area":       area_asignada
     }
-
-    guardar_config_a_yaml(config, ruta_yaml)
+    if _agregar_usuarios_a_config({username: nuevo}, ruta_yaml):
+        return False, f"El usuario '{username}' ya existe."
     return True, f"Usuario '{username}' creado exitosamente con rol '{role_asignado}' y área '{area_asignada}'."
 
 
+def importar_usuarios_csv(archivo, ruta_yaml="config.yaml") -> tuple[list, list]:
+    """
+    Crea usuarios en bloque desde un CSV con columnas 'username' y 'password'
+    (y opcionalmente first_name, last_name, email, role, area).
+    Las contraseñas se hashean en paralelo y config.yaml se escribe una sola vez.
+    Retorna (usuarios creados, mensajes de filas omitidas).
+    """
+    df = pd.read_csv(archivo, dtype=str, keep_default_na=False)
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    faltantes = {"username","password"} - set(df.columns)
+    if faltantes:
+        return [], [f"Faltan las columnas: {', '.join(sorted(faltantes))}"]
+
+    config, _ = obtener_config(ruta_yaml)
+    existentes = set(config["credentials"]["usernames"])
+
+    omitidas = []
+    filas = {}
+    for n, fila in enumerate(df.to_dict("records"), start=2):
+        username = fila["username"].strip()
+        role = fila.get("role", "").strip() or "viewer"
+        area = fila.get("area", "").strip() or "PRE"
+        if not username or not fila["password"]:
+            omitidas.append(f"Fila {n}: usuario o contraseña vacíos.")
+        elif username in existentes or username in filas:
+            omitidas.append(f"Fila {n}: el usuario '{username}' ya existe.")
+        elif role not in ROLES_USUARIO or area not in AREAS_USUARIO:
+            omitidas.append(f"Fila {n}: rol '{role}' o área '{area}' no válidos.")
+        else:
+            filas[username] = {
+                "first_name": fila.get("first_name", "").strip(),
+                "last_name":  fila.get("last_name", "").strip(),
+                "email":      fila.get("email", "").strip(),
+                "password":   fila["password"],
+                "role":       role,
+                "area":       area,
+            }
+
+    hashes = hashear_passwords([datos["password"] for datos in filas.values()])
+    for datos, hashed_pass in zip(filas.values(), hashes):
+        datos["password"] = hashed_pass
+
+    for username in _agregar_usuarios_a_config(filas, ruta_yaml):
+        del filas[username]
+        omitidas.append(f"El usuario '{username}' ya existe.")
+    return list(filas), omitidas
+
+
+def panel_usuarios_admin():
+    """
+    Panel lateral (solo admin): importación masiva de usuarios desde CSV y
+    latencias de bcrypt del proceso.
+    """
+    with st.sidebar.expander("Usuarios (importación masiva)"):
+        archivo = st.file_uploader(
+            "CSV con username, password, first_name, last_name, email, role, area",
+            type=["csv"],
+        )
+        if archivo is not None and st.button("Importar usuarios"):
+            creados, omitidas = importar_usuarios_csv(archivo)
+            if creados:
+                st.success(f"{len(creados)} usuario(s) creados.")
+            for mensaje in omitidas:
+                st.warning(mensaje)
+        st.caption(f"bcrypt: costo {BCRYPT_RONDAS}, {BCRYPT_HILOS} hilos")
+        st.dataframe(obtener_pool_bcrypt()["metricas"].resumen(), hide_index=True)
+
+
 def formulario_crear_usuario():
     """
     Muestra un formulario para crear un usuario (admin, editor o viewer).
@@ -86,9 +369,9 @@ def formulario_crear_usuario():
         nuevo_username = st.text_input("Nombre de Usuario")
         nuevo_first    = st.text_input("Nombre")
         # Selector de rol
-        rol_elegido    = st.selectbox("Rol del usuario", ["admin","editor","viewer"])
+        rol_elegido    = st.selectbox("Rol del usuario", ROLES_USUARIO)
         # Selector de área
-        area_elegida   = st.selectbox("Área del usuario", ["PRE","VPD","VPO","VPF","VPE"])
+        area_elegida   = st.selectbox("Área del usuario", AREAS_USUARIO)
     with col2:
         nuevo_last     = st.text_input("Apellido")
         nuevo_email    = st.text_input("Email (opcional)")
@@ -123,46 +406,22 @@ def formulario_crear_usuario():
 ########################################
 # 3) Funciones de Cálculo y Formato
 ########################################
-def calcular_misiones(df: pd.DataFrame) -> pd.DataFrame:
-    """
-    Calcula columnas de costo total de misiones (pasaje, alojamiento, etc.)
-    en función de la cantidad de funcionarios, costo por día, etc.
-    """
-    df_calc = df.copy()
-    cols_base = ["cant_funcionarios","costo_pasaje","dias","alojamiento","perdiem_otros","movilidad"]
-    for col in cols_base:
-        if col not in df_calc.columns:
-            df_calc[col] = 0
-
-    df_calc["total_pasaje"] = df_calc["cant_funcionarios"] * df_calc["costo_pasaje"]
-    df_calc["total_alojamiento"] = df_calc["cant_funcionarios"] * df_calc["dias"] * df_calc["alojamiento"]
-    df_calc["total_perdiem_otros"] = df_calc["cant_funcionarios"] * df_calc["dias"] * df_calc["perdiem_otros"]
-    df_calc["total_movilidad"] = df_calc["cant_funcionarios"] * df_calc["movilidad"]
-    df_calc["total"] = (
-        df_calc["total_pasaje"]
-        + df_calc["total_alojamiento"]
-        + df_calc["total_perdiem_otros"]
-        + df_calc["total_movilidad"]
-    )
-    return df_calc
-
-def calcular_consultores(df: pd.DataFrame) -> pd.DataFrame:
+@st.cache_resource
+def obtener_cache_calculos():
     """
-    Calcula el costo total de consultorías:
-    cantidad_funcionarios * cantidad_meses * monto_mensual
+    Caché de tablas calculadas única por proceso. La clave es el esquema,
+    la versión de sus fórmulas y la huella exacta de la tabla de entrada.
     """
-    df_calc = df.copy()
-    cols_base = ["cantidad_funcionarios","cantidad_meses","monto_mensual"]
-    for col in cols_base:
-        if col not in df_calc.columns:
-            df_calc[col] = 0
+    return CacheLRU(capacidad=64)
 
-    df_calc["total"] = (
-        df_calc["cantidad_funcionarios"]
-        * df_calc["cantidad_meses"]
-        * df_calc["monto_mensual"]
-    )
-    return df_calc
+
+def calcular_tabla(df: pd.DataFrame, esquema: str) -> pd.DataFrame:
+    """
+    Tabla 'df' con las columnas derivadas de ESQUEMAS_CALCULO[esquema].
+    Una tabla sin cambios no se recalcula entre ejecuciones ni entre sesiones.
+    """
+    clave = (esquema, ESQUEMAS_CALCULO[esquema]["version"], huella_exacta(df))
+    return obtener_cache_calculos().obtener(clave, lambda: evaluar_esquema(df, esquema))
 
 
 def two_decimals_only_numeric(df: pd.DataFrame):
@@ -189,222 +448,951 @@ def value_box(label: str, value, bg_color: str="#6c757d"):
     </div>
     """, unsafe_allow_html=True)
 
-def mostrar_value_boxes_por_area(df: pd.DataFrame, col_area: str="area_imputacion"):
+def matriz_totales() -> pd.DataFrame:
+    """
+    Matriz de totales de las tablas de la sesión. Se recalcula solo cuando
+    alguna tabla de la sesión fue reemplazada (las tablas no se modifican
+    in situ), de modo que sync, value boxes y Actualización la comparten.
+    """
+    tablas = {c: st.session_state[c] for c in TABLAS_TOTALES if c in st.session_state}
+    previa = st.session_state.get("_matriz_totales")
+    if (previa is not None and previa["tablas"].keys() == tablas.keys()
+            and all(previa["tablas"][c] is df for c, df in tablas.items())):
+        return previa["matriz"]
+    matriz = calcular_matriz_totales(tablas, calcular_tabla)
+    st.session_state["_matriz_totales"] = {"tablas": tablas, "matriz": matriz}
+    return matriz
+
+
+def total_tabla(clave: str, area: str=None, medida: str="calculado") -> float:
+    """
+    Total de la tabla 'clave' (de todas sus filas o solo de 'area')
+    leído de la matriz de totales. Retorna 0 si no hay datos.
+    """
+    return total_matriz(matriz_totales(), clave, area=area, medida=medida)
+
+
+def mostrar_value_boxes_por_area(clave: str, medida: str="calculado"):
     """
     Muestra un 'value box' por cada área (VPD, VPO, VPF, PRE),
-    con la suma de la columna 'total' filtrando por esa área.
-    """
-    areas_imputacion = ["VPD","VPO","VPF","PRE"]
-    cols = st.columns(len(areas_imputacion))
-    for i, area in enumerate(areas_imputacion):
-        total_area = 0
-        if col_area in df.columns and "total" in df.columns:
-            total_area = df.loc[df[col_area]==area,"total"].sum()
+    con el total de la tabla 'clave' en esa área (de la matriz de totales).
+    """
+    cols = st.columns(len(AREAS_IMPUTACION))
+    for i, area in enumerate(AREAS_IMPUTACION):
+        total_area = total_tabla(clave, area=area, medida=medida)
         with cols[i]:
             value_box(area, f"{total_area:,.2f}")
 
 
+@st.cache_resource
+def obtener_cache_exportaciones():
+    """Bytes de Excel ya generados (por huella exacta de la tabla), únicos por proceso."""
+    return CacheLRU(capacidad=32)
+
+
+def excel_bytes(df: pd.DataFrame) -> bytes:
+    """'df' como archivo .xlsx (hoja 'Hoja1'); una tabla sin cambios no se regenera."""
+    def generar():
+        buffer = io.BytesIO()
+        with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+            df.to_excel(writer, sheet_name="Hoja1", index=False)
+        return buffer.getvalue()
+    return obtener_cache_exportaciones().obtener(huella_exacta(df), generar)
+
+
 def descargar_excel(df: pd.DataFrame, file_name: str="descarga.xlsx") -> None:
     """
     Crea un botón para descargar 'df' en formato Excel.
+    El archivo se genera recién al hacer clic (y se reutiliza si la tabla no cambió).
     """
-    buffer = io.BytesIO()
-    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-        df.to_excel(writer, sheet_name="Hoja1", index=False)
-    datos_excel = buffer.getvalue()
     st.download_button(
         label="Descargar tabla en Excel",
-        data=datos_excel,
+        data=lambda: excel_bytes(df),
         file_name=file_name,
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
 
 
-def guardar_en_excel(df: pd.DataFrame, sheet_name: str, excel_file: str="main_bdd.xlsx"):
+########################################
+# Almacén de datos (Excel o SQLite)
+########################################
+# Los almacenes y la lectura/escritura de hojas están en presupuesto_nucleo;
+# aquí, el almacén único del proceso y la caché de tablas compartida.
+def exportar_paquete_excel(claves) -> io.IOBase:
+    """
+    Libro .xlsx con las tablas 'claves' tal como están en el almacén (una hoja
+    por tabla; las que tienen esquema de cálculo, con sus totales calculados,
+    y el consolidado y el cuadro 9 derivados de las tablas de actualización).
+    Usa el modo write_only de openpyxl: las filas se escriben en bloques y se
+    vuelcan a un archivo temporal, sin armar cada hoja completa en memoria.
+    Retorna el archivo posicionado al inicio.
+    """
+    tablas, _ = obtener_tablas_compartidas(claves)
+    if {"consolidado_df","cuadro_9"} & set(claves):
+        base, _ = obtener_tablas_compartidas(["consolidado_df","cuadro_9"] + HOJAS_ACTUALIZACION)
+        tablas = dict(tablas)
+        tablas["consolidado_df"], tablas["cuadro_9"] = MotorConsolidado().actualizar(
+            base["consolidado_df"], base["cuadro_9"], {hoja: base[hoja] for hoja in HOJAS_ACTUALIZACION}
+        )
+    wb = Workbook(write_only=True)
+    for clave in claves:
+        df = tablas[clave]
+        if TABLAS_TOTALES.get(clave):
+            df = calcular_tabla(df, TABLAS_TOTALES[clave])
+        ws = wb.create_sheet(title=HOJAS_EXCEL[clave])
+        ws.append([str(col) for col in df.columns])
+        for inicio in range(0, len(df), 1000):
+            bloque = df.iloc[inicio:inicio + 1000].astype(object)
+            bloque = bloque.where(bloque.notna(), None)
+            for fila in bloque.itertuples(index=False, name=None):
+                ws.append(list(fila))
+    archivo = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    wb.save(archivo)
+    archivo.seek(0)
+    return archivo
+
+
+@st.cache_resource
+def obtener_almacen():
+    """
+    Almacén configurado (PRESUPUESTO_ALMACEN), único por proceso.
+    Con SQLite, si la base está vacía se importa main_bdd.xlsx la primera vez.
+    """
+    return crear_almacen(BACKEND_ALMACEN, EXCEL_FILE, SQLITE_FILE)
+
+
+@st.cache_resource
+def _cache_tablas_compartido(identificador: str) -> dict:
+    """
+    Caché de proceso (una por almacén), compartida por todas las sesiones.
+    """
+    return {"lock": threading.Lock(), "version": None, "huellas": {}, "tablas": {}}
+
+
+def obtener_tablas_compartidas(claves):
+    """
+    Retorna ({clave: DataFrame}, {clave: huella}) desde la caché de proceso.
+    - Si la versión del almacén no cambió, no se leen datos (Excel: un stat).
+    - Si cambió, se comparan las huellas por hoja y se descartan solo las
+      hojas modificadas; el resto sigue en memoria.
+    Los DataFrames son compartidos entre sesiones: tratarlos como solo lectura.
+    """
+    almacen = obtener_almacen()
+    cache = _cache_tablas_compartido(almacen.identificador)
+    with cache["lock"]:
+        version = almacen.version()
+        if version != cache["version"]:
+            huellas_almacen = almacen.huellas()
+            huellas_nuevas = {clave: huellas_almacen.get(hoja) for clave, hoja in HOJAS_EXCEL.items()}
+            for clave in list(cache["tablas"]):
+                if huellas_nuevas.get(clave) != cache["huellas"].get(clave):
+                    del cache["tablas"][clave]
+            cache["huellas"] = huellas_nuevas
+            cache["version"] = version
+
+        faltantes = [clave for clave in claves if clave not in cache["tablas"]]
+        if faltantes:
+            cache["tablas"].update(cargar_tablas(faltantes, almacen))
+
+        tablas  = {clave: cache["tablas"][clave] for clave in claves}
+        huellas = {clave: cache["huellas"].get(clave) for clave in claves}
+    return tablas, huellas
+
+
+def asegurar_tablas(claves, refrescar: bool=True) -> list:
+    """
+    Carga en la sesión las tablas 'claves' que aún no están (carga diferida:
+    cada sección pide solo lo que usa). Con refrescar=True también reemplaza
+    las que cambiaron en el almacén desde que se cargaron en la sesión.
+    Las tablas son referencias a la caché de proceso (solo lectura).
+    Retorna las claves cargadas o reemplazadas.
+    """
+    huellas_sesion = st.session_state.setdefault("_huellas_tablas", {})
+    if not refrescar:
+        claves = [clave for clave in claves if clave not in st.session_state]
+    if not claves:
+        return []
+    tablas, huellas = obtener_tablas_compartidas(claves)
+    cargadas = []
+    for clave, df in tablas.items():
+        if clave not in st.session_state or huellas_sesion.get(clave) != huellas[clave]:
+            cargadas.append(clave)
+            if clave == "com" and clave not in st.session_state and huellas[clave] is None:
+                st.warning("No se encontró la hoja COM. Se crea un DataFrame vacío.")
+            if clave == "dpp_metas" and huellas[clave] is None:
+                st.warning(
+                    "No se encontró la hoja dpp_metas. Se usan los montos DPP 2025 iniciales; "
+                    "para crear la hoja: `python presupuesto_nucleo.py --migrar`."
+                )
+            if clave == "filas_destacadas" and huellas[clave] is None:
+                st.warning(
+                    "No se encontró la hoja filas_destacadas. Se resaltan las filas iniciales; "
+                    "para crear la hoja: `python presupuesto_nucleo.py --migrar`."
+                )
+            st.session_state[clave] = df
+            huellas_sesion[clave] = huellas[clave]
+    return cargadas
+
+
+class ColaEscritura:
+    """
+    Escritura diferida (write-behind): recibe trabajos de guardado, los combina
+    por hoja y los persiste desde un hilo de fondo con una escritura del almacén
+    por tanda. La interfaz se actualiza con la copia en memoria sin esperar al disco.
+    Cada trabajo recuerda de qué lotes (lote_escritura) viene: un lote se
+    escribe entero o no se escribe.
+    Cada tanda persistida se agrega al 'diario' de cambios, si lo hay.
+    """
+
+    # Segundos que se espera antes de escribir, para combinar guardados seguidos
+    ESPERA_COMBINAR = 0.3
+
+    def __init__(self, almacen, diario: DiarioCambios=None):
+        self.almacen = almacen
+        self.diario = diario
+        self._cond = threading.Condition()
+        self._pendientes = {}   # hoja -> {"reemplazo", "filas", "version", "lotes", "autor"}
+        self._escribiendo = 0
+        self._ultimo_guardado = None
+        self._errores = {}      # id de sesión -> [mensajes]
+        self._hilo = threading.Thread(target=self._trabajar, name="cola-escritura", daemon=True)
+        self._hilo.start()
+        atexit.register(self.esperar, 30)
+
+    def encolar(self, reemplazos: dict, filas: dict, versiones: dict, sesion: str, autor: dict=None):
+        """
+        Agrega los cambios de un lote. Los guardados de la misma sesión sobre una
+        hoja pendiente se combinan (se verifica la versión del primero); si la hoja
+        tiene pendiente una edición de otra sesión, se lanza ConflictoVersionError.
+        'autor' ({"usuario", "area"}) es lo que se anota en el diario de cambios.
+        """
+        lote = uuid.uuid4().hex
+        with self._cond:
+            for hoja in set(reemplazos) | set(filas):
+                previo = self._pendientes.get(hoja)
+                if (previo is not None and sesion not in previo["lotes"].values()
+                        and previo["version"] is not None and versiones.get(hoja) is not None):
+                    raise ConflictoVersionError(hoja)
+
+            for hoja, df in reemplazos.items():
+                trabajo = self._trabajo(hoja, lote, sesion, versiones.get(hoja), autor)
+                trabajo["reemplazo"], trabajo["filas"] = df, None
+            for hoja, df_filas in filas.items():
+                trabajo = self._trabajo(hoja, lote, sesion, versiones.get(hoja), autor)
+                if trabajo["reemplazo"] is not None:
+                    trabajo["reemplazo"] = aplicar_filas(trabajo["reemplazo"], df_filas)
+                elif trabajo["filas"] is not None:
+                    trabajo["filas"] = aplicar_filas(trabajo["filas"], df_filas)
+                else:
+                    trabajo["filas"] = df_filas
+            self._cond.notify_all()
+
+    def _trabajo(self, hoja: str, lote: str, sesion: str, version: str, autor: dict=None):
+        """Trabajo pendiente de 'hoja'; 'lotes' ({lote: sesión}) son los lotes combinados en él."""
+        trabajo = self._pendientes.setdefault(
+            hoja, {"reemplazo": None, "filas": None, "version": version, "lotes": {}, "autor": autor}
+        )
+        if trabajo["version"] is None:
+            trabajo["version"] = version
+        trabajo["lotes"][lote] = sesion
+        trabajo["autor"] = autor
+        return trabajo
+
+    def _trabajar(self):
+        while True:
+            with self._cond:
+                while not self._pendientes:
+                    self._cond.wait()
+            time.sleep(self.ESPERA_COMBINAR)
+            with self._cond:
+                tanda, self._pendientes = self._pendientes, {}
+                self._escribiendo = len(tanda)
+            try:
+                self._persistir(tanda)
+            finally:
+                with self._cond:
+                    self._escribiendo = 0
+                    self._cond.notify_all()
+
+    def _persistir(self, tanda: dict):
+        """
+        Escribe la tanda completa en una sola escritura del almacén. Si una hoja
+        tiene conflicto de versión, se descartan todos los lotes combinados en
+        ella y, con ellos, todas las hojas de esos lotes (y de los lotes
+        combinados con esas hojas): de un lote no se escribe nada y sus sesiones
+        reciben el error. Los lotes que no comparten hojas con los descartados
+        se escriben en el siguiente intento.
+        """
+        while tanda:
+            reemplazos = {h: t["reemplazo"] for h, t in tanda.items() if t["reemplazo"] is not None}
+            filas      = {h: t["filas"] for h, t in tanda.items() if t["filas"] is not None}
+            versiones  = {h: t["version"] for h, t in tanda.items() if t["version"] is not None}
+            try:
+                self.almacen.escribir(reemplazos, filas, versiones)
+            except ConflictoVersionError as e:
+                directas = set(tanda[e.hoja]["lotes"].values())
+                for sesion in set(self._descartar_lotes(tanda, e.hoja).values()):
+                    self._registrar_error(sesion, str(e) if sesion in directas else (
+                        f"No se guardaron tus cambios: se combinaron con un cambio rechazado "
+                        f"sobre la hoja '{e.hoja}'. Recarga la página y vuelve a guardar."
+                    ))
+                continue
+            except Exception as e:
+                for sesion in {s for t in tanda.values() for s in t["lotes"].values()}:
+                    self._registrar_error(sesion, f"No se pudo guardar: {e}")
+                return
+            self._ultimo_guardado = time.time()
+            if self.diario is not None:
+                try:
+                    self.diario.registrar(reemplazos, filas, {h: t["autor"] for h, t in tanda.items()})
+                except Exception as e:
+                    for sesion in {s for t in tanda.values() for s in t["lotes"].values()}:
+                        self._registrar_error(sesion, f"Guardado, pero no se pudo anotar en el diario: {e}")
+            return
+
+    @staticmethod
+    def _descartar_lotes(tanda: dict, hoja: str) -> dict:
+        """
+        Quita de 'tanda' la hoja 'hoja' y toda hoja que comparta un lote con
+        las quitadas (cierre transitivo). Retorna los lotes descartados {lote: sesión}.
+        """
+        descartados = dict(tanda.pop(hoja)["lotes"])
+        while True:
+            alcanzadas = [h for h, t in tanda.items() if descartados.keys() & t["lotes"].keys()]
+            if not alcanzadas:
+                return descartados
+            for h in alcanzadas:
+                descartados.update(tanda.pop(h)["lotes"])
+
+    def _registrar_error(self, sesion: str, mensaje: str):
+        with self._cond:
+            self._errores.setdefault(sesion, []).append(mensaje)
+
+    def tomar_errores(self, sesion: str) -> list:
+        """Retorna (y descarta) los errores de guardado de la sesión."""
+        with self._cond:
+            return self._errores.pop(sesion, [])
+
+    def estado(self) -> dict:
+        with self._cond:
+            return {
+                "pendientes": len(self._pendientes) + self._escribiendo,
+                "ultimo_guardado": self._ultimo_guardado,
+            }
+
+    def esperar(self, timeout: float=None) -> bool:
+        """Bloquea hasta que no queden escrituras pendientes. Retorna False si venció el timeout."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._pendientes and not self._escribiendo, timeout=timeout
+            )
+
+
+@st.cache_resource
+def obtener_diario():
+    """Diario de cambios del almacén configurado, único por proceso (None si está desactivado)."""
+    if not DIARIO_DIR:
+        return None
+    return DiarioCambios(DIARIO_DIR, obtener_almacen())
+
+
+@st.cache_resource
+def obtener_cola_escritura():
+    """Cola de escritura única por proceso, sobre el almacén configurado."""
+    return ColaEscritura(obtener_almacen(), obtener_diario())
+
+
+def autor_sesion() -> dict:
+    """Usuario y área de la sesión, tal como se anotan en el diario de cambios."""
+    return {"usuario": st.session_state.get("username"), "area": st.session_state.get("user_area")}
+
+
+def id_sesion() -> str:
+    """Identificador estable de la sesión del navegador (para avisos de guardado)."""
+    if "_id_sesion" not in st.session_state:
+        st.session_state["_id_sesion"] = uuid.uuid4().hex
+    return st.session_state["_id_sesion"]
+
+
+def mostrar_estado_guardado():
+    """
+    Muestra en la barra lateral el estado de la cola de escritura y los errores
+    de guardado diferido de esta sesión.
+    """
+    cola = obtener_cola_escritura()
+    for mensaje in cola.tomar_errores(id_sesion()):
+        st.error(mensaje)
+    estado = cola.estado()
+    if estado["pendientes"]:
+        st.sidebar.info(f"Guardando cambios ({estado['pendientes']} hoja(s) pendientes)...")
+    elif estado["ultimo_guardado"]:
+        hora = time.strftime("%H:%M:%S", time.localtime(estado["ultimo_guardado"]))
+        st.sidebar.caption(f"Cambios guardados ({hora})")
+
+
+def panel_historial_admin():
+    """
+    Panel lateral (solo admin): últimos cambios del diario y reconstrucción
+    de una hoja tal como estaba en una fecha y hora.
+    """
+    diario = obtener_diario()
+    if diario is None:
+        return
+    with st.sidebar.expander("Historial de cambios"):
+        hoja = st.selectbox("Hoja", sorted(set(HOJAS_EXCEL.values())), key="historial_hoja")
+        st.dataframe(diario.historial(hoja, limite=20), hide_index=True)
+        fecha = st.date_input("Fecha", key="historial_fecha")
+        hora = st.time_input("Hora", key="historial_hora")
+        if st.button("Reconstruir hoja"):
+            instante = datetime.datetime.combine(fecha, hora).timestamp()
+            df = diario.tabla_en(hoja, instante)
+            if df is None:
+                st.warning("El diario no tiene datos anteriores a esa fecha.")
+            else:
+                st.dataframe(df)
+                descargar_excel(df, file_name=f"{hoja}_{fecha}_{hora.strftime('%H%M')}.xlsx")
+
+
+# Lote de escritura activo en el hilo actual (cada sesión corre en su propio hilo)
+_lote_escritura = threading.local()
+
+
+@contextmanager
+def lote_escritura(sincronico: bool=False):
+    """
+    Agrupa las llamadas a guardar_tabla / guardar_filas hechas dentro del bloque
+    y al salir las entrega juntas a la cola de escritura (la última versión
+    de cada hoja gana). Si el bloque lanza una excepción no se escribe nada.
+    Un lote anidado se suma al lote exterior.
+    Si otra sesión tiene pendiente un cambio sobre la misma hoja, se lanza
+    ConflictoVersionError y no se encola ninguna hoja del lote. Si el conflicto
+    aparece al persistir, la cola descarta el lote entero (ver ColaEscritura).
+    Con 'sincronico' el lote no pasa por la cola: al salir se espera a que la
+    cola se vacíe y se escribe con una sola llamada al almacén, de modo que un
+    ConflictoVersionError se lanza aquí y, si no se lanza, el lote ya está guardado.
+    """
+    if getattr(_lote_escritura, "pendientes", None) is not None:
+        yield
+        return
+
+    _lote_escritura.pendientes = {"reemplazos": {}, "filas": {}, "versiones": {}}
+    try:
+        yield
+        pendientes = _lote_escritura.pendientes
+    finally:
+        _lote_escritura.pendientes = None
+
+    if not pendientes["reemplazos"] and not pendientes["filas"]:
+        return
+    if not sincronico:
+        obtener_cola_escritura().encolar(
+            pendientes["reemplazos"], pendientes["filas"], pendientes["versiones"], id_sesion(), autor_sesion()
+        )
+        return
+
+    # Lo pendiente en la cola se escribe antes, para que las versiones se
+    # verifiquen contra el almacén al día
+    obtener_cola_escritura().esperar()
+    obtener_almacen().escribir(pendientes["reemplazos"], pendientes["filas"], pendientes["versiones"])
+    diario = obtener_diario()
+    if diario is not None:
+        autor = autor_sesion()
+        hojas = [*pendientes["reemplazos"], *pendientes["filas"]]
+        diario.registrar(pendientes["reemplazos"], pendientes["filas"], {hoja: autor for hoja in hojas})
+
+
+def _registrar_version_esperada(pendientes: dict, sheet_name: str, version_esperada: str):
+    """La primera versión esperada de cada hoja en el lote es la que se verifica."""
+    if version_esperada is not None:
+        pendientes["versiones"].setdefault(sheet_name, version_esperada)
+
+
+def guardar_tabla(df: pd.DataFrame, sheet_name: str, version_esperada: str=None):
     """
-    Guarda 'df' en la hoja 'sheet_name' del archivo 'excel_file', reemplazándola.
+    Guarda 'df' en la hoja 'sheet_name' del almacén, reemplazándola.
+    Dentro de un 'with lote_escritura()' la escritura se difiere al cierre del lote.
+    'version_esperada' es la huella_contenido de la tabla sobre la que se editó.
     """
-    from openpyxl import Workbook
-    with pd.ExcelWriter(excel_file, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
-        df.to_excel(writer, sheet_name=sheet_name, index=False)
+    with lote_escritura():
+        pendientes = _lote_escritura.pendientes
+        _registrar_version_esperada(pendientes, sheet_name, version_esperada)
+        pendientes["reemplazos"][sheet_name] = df
+        pendientes["filas"].pop(sheet_name, None)
+
+
+def guardar_filas(df_filas: pd.DataFrame, sheet_name: str, version_esperada: str=None):
+    """
+    Upsert de filas en la hoja 'sheet_name' (índice de 'df_filas' = posición de fila).
+    Dentro de un lote se combina con lo que ya esté pendiente para esa hoja.
+    """
+    with lote_escritura():
+        pendientes = _lote_escritura.pendientes
+        _registrar_version_esperada(pendientes, sheet_name, version_esperada)
+        if sheet_name in pendientes["reemplazos"]:
+            pendientes["reemplazos"][sheet_name] = aplicar_filas(pendientes["reemplazos"][sheet_name], df_filas)
+        elif sheet_name in pendientes["filas"]:
+            pendientes["filas"][sheet_name] = aplicar_filas(pendientes["filas"][sheet_name], df_filas)
+        else:
+            pendientes["filas"][sheet_name] = df_filas
 
 
 ########################################
 # 4) Funciones para Actualización
 ########################################
-def actualizar_misiones(unit: str, req_area: float, monto_dpp: float):
+# Tablas que necesita sincronizar_actualizacion_al_iniciar
+DEPENDENCIAS_SYNC = list(TABLAS_TOTALES) + ["dpp_metas"] + HOJAS_ACTUALIZACION
+
+
+########################################
+# Metas DPP (hoja 'dpp_metas')
+########################################
+# Al cambiar la hoja en el almacén, cada sesión la recarga en su siguiente
+# ejecución (igual que las demás hojas), sin reiniciar el servidor.
+def metas_dpp() -> dict:
     """
-    Actualiza el DataFrame 'actualizacion_misiones' en session_state
-    con la fila (Unidad Organizacional, Requerimiento del Área, Monto DPP 2025, Diferencia).
+    Metas DPP de la sesión como dict (Tabla, Unidad Organizacional) -> monto.
+    Se rearma solo cuando la hoja 'dpp_metas' de la sesión fue reemplazada.
     """
-    if "actualizacion_misiones" not in st.session_state:
-        st.session_state["actualizacion_misiones"] = pd.DataFrame(
-            columns=["Unidad Organizacional","Requerimiento del Área","Monto DPP 2025","Diferencia"]
-        )
-    df_act = st.session_state["actualizacion_misiones"].copy()
-    mask = df_act["Unidad Organizacional"]==unit
-    diferencia = monto_dpp - req_area
-
-    if mask.any():
-        df_act.loc[mask,"Requerimiento del Área"] = req_area
-        df_act.loc[mask,"Monto DPP 2025"] = monto_dpp
-        df_act.loc[mask,"Diferencia"] = diferencia
-    else:
-        nueva_fila = {
-            "Unidad Organizacional": unit,
-            "Requerimiento del Área": req_area,
-            "Monto DPP 2025": monto_dpp,
-            "Diferencia": diferencia
-        }
-        df_act = pd.concat([df_act, pd.DataFrame([nueva_fila])], ignore_index=True)
+    df_metas = st.session_state.get("dpp_metas")
+    previa = st.session_state.get("_metas_dpp")
+    if previa is not None and previa["tabla"] is df_metas:
+        return previa["metas"]
+    metas = metas_desde_tabla(df_metas)
+    st.session_state["_metas_dpp"] = {"tabla": df_metas, "metas": metas}
+    return metas
+
+
+def meta_dpp(tabla: str, unidad: str) -> float:
+    """Monto DPP 2025 de 'unidad' en 'tabla' (0 si no está en la hoja de metas)."""
+    return metas_dpp().get((tabla, unidad), 0)
+
 
-    st.session_state["actualizacion_misiones"] = df_act
-    guardar_en_excel(df_act, "actualizacion_misiones")
+def meta_dpp_seccion(clave: str) -> float:
+    """Monto DPP 2025 que se muestra en la sección DPP 2025 de la tabla 'clave'."""
+    return meta_dpp(*METAS_SECCION[clave])
 
-def actualizar_consultorias(unit: str, req_area: float, monto_dpp: float):
+
+def sincronizar_actualizacion_al_iniciar():
     """
-    Similar a actualizar_misiones pero para 'actualizacion_consultorias'.
+    Actualiza automáticamente las tablas 'actualizacion_misiones' y 'actualizacion_consultorias'
+    en función de lo que haya en st.session_state (cargando antes las tablas
+    de DEPENDENCIAS_SYNC que falten). Es el nodo "actualizacion" del grafo de
+    tablas: lo ejecuta propagar_cambios, al guardar o al recargarse una fuente.
+    Las tablas se comparan con su versión persistida y solo se escriben
+    en el libro si algo cambió (a lo sumo una escritura por tabla).
     """
-    if "actualizacion_consultorias" not in st.session_state:
-        st.session_state["actualizacion_consultorias"] = pd.DataFrame(
-            columns=["Unidad Organizacional","Requerimiento del Área","Monto DPP 2025","Diferencia"]
+    # Solo las tablas de las que depende (las ya cargadas no se refrescan:
+    # pueden tener el cambio que se está guardando)
+    asegurar_tablas(DEPENDENCIAS_SYNC, refrescar=False)
+
+    # Versión persistida según el almacén (no la copia en memoria de la sesión,
+    # que puede contener cambios de un guardado que falló)
+    persistidas, _ = obtener_tablas_compartidas(HOJAS_ACTUALIZACION)
+
+    st.session_state["actualizacion_misiones"], st.session_state["actualizacion_consultorias"] = (
+        conciliar_actualizacion(
+            matriz_totales(),
+            metas_dpp(),
+            [clave for clave in TABLAS_TOTALES if clave in st.session_state],
+            st.session_state.get("actualizacion_misiones"),
+            st.session_state.get("actualizacion_consultorias"),
         )
-    df_act = st.session_state["actualizacion_consultorias"].copy()
-    mask = df_act["Unidad Organizacional"]==unit
-    diferencia = monto_dpp - req_area
-
-    if mask.any():
-        df_act.loc[mask,"Requerimiento del Área"] = req_area
-        df_act.loc[mask,"Monto DPP 2025"] = monto_dpp
-        df_act.loc[mask,"Diferencia"] = diferencia
-    else:
-        nueva_fila = {
-            "Unidad Organizacional": unit,
-            "Requerimiento del Área": req_area,
-            "Monto DPP 2025": monto_dpp,
-            "Diferencia": diferencia
-        }
-        df_act = pd.concat([df_act, pd.DataFrame([nueva_fila])], ignore_index=True)
+    )
 
-    st.session_state["actualizacion_consultorias"] = df_act
-    guardar_en_excel(df_act, "actualizacion_consultorias")
+    # Escritura solo de lo que difiere de lo persistido
+    reemplazos, filas = cambios_tablas(
+        {hoja: st.session_state[hoja] for hoja in HOJAS_ACTUALIZACION}, persistidas
+    )
+    for hoja, df in reemplazos.items():
+        guardar_tabla(df, hoja)
+    for hoja, df_filas in filas.items():
+        guardar_filas(df_filas, hoja)
 
 
 ########################################
-# Valores fijos para el DPP
+# Grafo de dependencias entre tablas
 ########################################
-DPP_VALORES = {
-    "VPD": {"misiones":168000,"consultorias":130000},
-    "VPO": {"misiones":434707,"consultorias":250000},
-    "VPF": {"misiones":138600,"consultorias":200000},
-    "VPE": {"misiones":28244,  "consultorias":179446},
-    "PRE": {"misiones":0,      "consultorias":0},
+# Nodo derivado -> tablas o nodos de los que depende. Las hojas del almacén
+# son las fuentes: hojas de las áreas -> matriz de totales (con sus esquemas
+# de cálculo) -> tablas de actualización -> consolidado. Las tablas de
+# actualización persistidas son también entrada de su nodo (la base que se
+# concilia): si se recargan, se vuelven a conciliar.
+GRAFO_TABLAS = {
+    "matriz_totales": list(TABLAS_TOTALES),
+    "actualizacion":  ["matriz_totales", "dpp_metas", *HOJAS_ACTUALIZACION],
+    "consolidado":    ["actualizacion", "consolidado_df", "cuadro_9"],
 }
 
-DPP_GC_MIS_PER = {"VPD":36960,"VPO":48158,"VPF":40960}
-DPP_GC_MIS_CONS= {"VPD":24200,"VPO":13160,"VPF":24200}
-DPP_GC_CONS    = {"VPD":24200,"VPO":13160,"VPF":24200}
+# Cómo se recalcula cada nodo (sobre las tablas de la sesión)
+RECALCULO_TABLAS = {
+    "matriz_totales": lambda: matriz_totales(),
+    "actualizacion":  lambda: sincronizar_actualizacion_al_iniciar(),
+    "consolidado":    lambda: sincronizar_consolidado(),
+}
 
+ORDEN_TABLAS = list(graphlib.TopologicalSorter(GRAFO_TABLAS).static_order())
 
-def sincronizar_actualizacion_al_iniciar():
+
+def nodos_dependientes(origenes) -> list:
+    """Nodos derivados alcanzables desde 'origenes', en orden topológico."""
+    afectados = set(origenes)
+    nodos = []
+    for nodo in ORDEN_TABLAS:
+        if nodo in GRAFO_TABLAS and afectados.intersection(GRAFO_TABLAS[nodo]):
+            afectados.add(nodo)
+            nodos.append(nodo)
+    return nodos
+
+
+def propagar_cambios(origenes) -> list:
     """
-    Actualiza automáticamente las tablas 'actualizacion_misiones' y 'actualizacion_consultorias'
-    en función de lo que haya en st.session_state.
-    Así se calculan montos y diferencias en cada carga de la app.
-    """
-    unidades = ["VPD","VPO","VPF","VPE"]
-    for unidad in unidades:
-        df_misiones_key = f"{unidad.lower()}_misiones"
-        if df_misiones_key in st.session_state:
-            df_temp = st.session_state[df_misiones_key].copy()
-            if unidad != "VPE":  # VPE no usa la fórmula de cálculo
-                df_temp = calcular_misiones(df_temp)
-            total_misiones = df_temp["total"].sum() if "total" in df_temp.columns else 0
-            dpp_misiones = DPP_VALORES[unidad]["misiones"]
-            actualizar_misiones(unidad, total_misiones, dpp_misiones)
-
-        df_consult_key = f"{unidad.lower()}_consultores"
-        if df_consult_key in st.session_state:
-            df_temp = st.session_state[df_consult_key].copy()
-            if unidad != "VPE":
-                df_temp = calcular_consultores(df_temp)
-            total_cons = df_temp["total"].sum() if "total" in df_temp.columns else 0
-            dpp_cons = DPP_VALORES[unidad]["consultorias"]
-            actualizar_consultorias(unidad, total_cons, dpp_cons)
-
-    # PRE maneja "pre_misiones_personal", "pre_misiones_consultores" y "pre_consultores"
-    if "pre_misiones_personal" in st.session_state:
-        df_personal = st.session_state["pre_misiones_personal"].copy()
-        df_personal = calcular_misiones(df_personal)
-        total_personal = df_personal.loc[df_personal["area_imputacion"]=="PRE","total"].sum()
-    else:
-        total_personal = 0
+    Recalcula en una sola pasada y en orden topológico todo lo que depende de
+    'origenes' (tablas recién guardadas o recargadas): cada nodo se ejecuta
+    una vez, con sus dependencias ya al día. Antes se refrescan desde el
+    almacén las demás fuentes, para no derivar de copias viejas de la sesión
+    (la tabla que se está guardando no se toca). Retorna los nodos recalculados.
+    """
+    nodos = nodos_dependientes(origenes)
+    fuentes = {
+        dep for nodo in nodos for dep in GRAFO_TABLAS[nodo]
+        if dep not in GRAFO_TABLAS and dep not in origenes
+    }
+    asegurar_tablas(sorted(fuentes))
+    for nodo in nodos:
+        RECALCULO_TABLAS[nodo]()
+    return nodos
 
-    if "pre_misiones_consultores" in st.session_state:
-        df_mis_cons = st.session_state["pre_misiones_consultores"].copy()
-        df_mis_cons = calcular_misiones(df_mis_cons)
-        total_misiones_cons = df_mis_cons.loc[df_mis_cons["area_imputacion"]=="PRE","total"].sum()
-    else:
-        total_misiones_cons = 0
 
-    if "pre_consultores" in st.session_state:
-        df_cons = st.session_state["pre_consultores"].copy()
-        df_cons = calcular_consultores(df_cons)
-    else:
-        df_cons = pd.DataFrame(columns=["area_imputacion","total"])
+########################################
+# 5) Editar Tabla con Control de Rol
+########################################
+def guardar_tabla_editada(
+    df_nuevo: pd.DataFrame,
+    df_base: pd.DataFrame,
+    session_key: str,
+    sheet_name: str,
+    df_filas: pd.DataFrame=None
+) -> bool:
+    """
+    Guarda la tabla editada y todo lo que depende de ella (propagar_cambios)
+    en un solo lote. Con 'df_filas' (filas tocadas, índice = posición) se
+    guarda solo ese parche de filas; si no, se reemplaza la hoja.
+    La sesión ve el cambio de inmediato; la escritura a disco la hace la cola
+    en segundo plano, verificando que nadie haya modificado la hoja desde que
+    se leyó 'df_base'. Si hubo conflicto, restaura la tabla de la sesión,
+    muestra el error y retorna False.
+    """
+    st.session_state[session_key] = df_nuevo
+    try:
+        with lote_escritura():
+            if df_filas is None:
+                guardar_tabla(df_nuevo, sheet_name, version_esperada=huella_contenido(df_base))
+            else:
+                guardar_filas(df_filas, sheet_name, version_esperada=huella_contenido(df_base))
+            propagar_cambios([session_key])
+    except ConflictoVersionError as e:
+        st.session_state[session_key] = df_base
+        st.error(str(e))
+        return False
+    return True
 
-    total_consultorias_PRE = df_cons.loc[df_cons["area_imputacion"]=="PRE","total"].sum()
 
-    # DPP fijos para PRE
-    dpp_pre_personal     = 80248
-    dpp_pre_mis_cons     = 30872
-    dpp_pre_consultorias = 307528
+def aplicar_cambios_editor(df: pd.DataFrame, cambios: dict, esquema=None):
+    """
+    Aplica a 'df' (la hoja tal como está en el almacén) los cambios de
+    st.data_editor (edited_rows, added_rows y deleted_rows, por posición de
+    fila) recalculando solo las filas tocadas.
+    Retorna (df_nuevo, df_filas): df_nuevo es exactamente lo que quedará en el
+    almacén (la vista se calcula con calcular_tabla); df_filas son las filas
+    editadas o agregadas (índice = posición de fila) para guardarlas como
+    parche, o None si se eliminaron filas y hay que reemplazar la hoja.
+    Las columnas derivadas que la hoja no guarda no se agregan.
+    """
+    base = df.reset_index(drop=True)
+    editadas  = {int(pos): valores for pos, valores in (cambios.get("edited_rows") or {}).items()}
+    agregadas = cambios.get("added_rows") or []
+    eliminadas = [int(pos) for pos in (cambios.get("deleted_rows") or [])]
+    derivadas = {col for col, _ in ESQUEMAS_CALCULO[esquema]["derivadas"]} if esquema else set()
+
+    posiciones = sorted(editadas)
+    registros = base.iloc[posiciones].to_dict("records")
+    for pos, registro in zip(posiciones, registros):
+        registro.update(editadas[pos])
+    registros += [dict(fila) for fila in agregadas]
+    indice = posiciones + list(range(len(base), len(base) + len(agregadas)))
+
+    df_filas = pd.DataFrame(registros, index=indice)
+    # Columnas del parche: las de la hoja y las editadas que no son derivadas
+    extra = [col for col in df_filas.columns if col not in base.columns and col not in derivadas]
+    df_filas = df_filas.reindex(columns=[*base.columns, *extra])
+    if esquema and not df_filas.empty:
+        df_filas = evaluar_esquema(df_filas, esquema)[[*base.columns, *extra]]
+    if df_filas.empty:
+        df_nuevo = base
+    elif agregadas:
+        df_nuevo = aplicar_filas(base, df_filas)
+    else:
+        # Solo ediciones: en memoria basta con reescribir las columnas que
+        # cambian (cada columna asignada se copia entera; la tabla base es compartida)
+        previas = base.loc[posiciones]
+        cambiadas = [col for col in df_filas.columns if col in extra or not previas[col].equals(df_filas[col])]
+        df_nuevo = aplicar_filas(base, df_filas[cambiadas])
 
-    actualizar_misiones("PRE - Misiones - Personal", total_personal, dpp_pre_personal)
-    actualizar_misiones("PRE - Misiones - Consultores", total_misiones_cons, dpp_pre_mis_cons)
-    actualizar_consultorias("PRE - Consultorías", total_consultorias_PRE, dpp_pre_consultorias)
+    if eliminadas:
+        return df_nuevo.drop(index=eliminadas).reset_index(drop=True), None
+    return df_nuevo, df_filas
 
-    # Consolidado de consultores en PRE
-    sum_vpd = df_cons.loc[df_cons["area_imputacion"]=="VPD","total"].sum()
-    sum_vpo = df_cons.loc[df_cons["area_imputacion"]=="VPO","total"].sum()
-    sum_vpf = df_cons.loc[df_cons["area_imputacion"]=="VPF","total"].sum()
 
-    dpp_vpd_consultorias = 193160
-    dpp_vpo_consultorias = 33160
-    dpp_vpf_consultorias = 88480
+########################################
+# Validación de archivos subidos (lectura en streaming)
+########################################
+# Filas que se convierten a DataFrame de una vez y máximo de errores que se
+# reportan antes de cortar la lectura
+BLOQUE_SUBIDA = 1000
+MAX_ERRORES_SUBIDA = 20
 
-    actualizar_consultorias("VPD - Consultorías", sum_vpd, dpp_vpd_consultorias)
-    actualizar_consultorias("VPO - Consultorías", sum_vpo, dpp_vpo_consultorias)
-    actualizar_consultorias("VPF - Consultorías", sum_vpf, dpp_vpf_consultorias)
 
-    # Gastos Centralizados
-    df_gc_personal = st.session_state.get("pre_misiones_personal", pd.DataFrame())
-    df_gc_personal = calcular_misiones(df_gc_personal)
-    df_gc_miscons  = st.session_state.get("pre_misiones_consultores", pd.DataFrame())
-    df_gc_miscons  = calcular_misiones(df_gc_miscons)
+def esquema_subida(df_actual: pd.DataFrame, esquema=None) -> tuple[list, set]:
+    """
+    (columnas requeridas, columnas numéricas) que debe tener un archivo que
+    reemplaza a 'df_actual': sus columnas menos las derivadas del esquema de
+    cálculo (se recalculan). Numéricas: las entradas del esquema y las que ya
+    son numéricas en la tabla. Sin tabla actual no se exige ninguna columna.
+    """
+    derivadas = {col for col, _ in ESQUEMAS_CALCULO[esquema]["derivadas"]} if esquema else set()
+    entradas = set(ESQUEMAS_CALCULO[esquema]["entradas"]) if esquema else set()
+    if df_actual is None or df_actual.columns.empty:
+        return [], entradas
+    requeridas = [col for col in df_actual.columns if col not in derivadas]
+    numericas = entradas | set(df_actual.select_dtypes(include="number").columns)
+    return requeridas, numericas - derivadas
+
+
+def _numero(valor):
+    """Valor numérico de una celda (None si está vacía); ValueError si no es número."""
+    if valor is None or (isinstance(valor, str) and not valor.strip()):
+        return None
+    if isinstance(valor, bool):
+        raise ValueError
+    if isinstance(valor, (int, float)):
+        return valor
+    return float(str(valor).strip())
+
+
+def leer_excel_validado(archivo, requeridas: list, numericas: set, permitidas: set=frozenset(), hoja: str=None):
+    """
+    Lee la hoja 'hoja' de 'archivo' (por defecto la primera) en modo read_only
+    de openpyxl, validándola mientras lee (ver _leer_hoja_validada).
+    Retorna (DataFrame, []) o (None, [errores por fila]).
+    """
+    try:
+        wb = load_workbook(archivo, read_only=True, data_only=True)
+    except Exception as e:
+        return None, [f"No se pudo abrir el archivo: {e}"]
+    try:
+        ws = wb[hoja] if hoja is not None else wb.worksheets[0]
+        return _leer_hoja_validada(ws, requeridas, numericas, permitidas)
+    finally:
+        wb.close()
 
-    for unidad in ["VPD","VPO","VPF"]:
-        total_unidad = df_gc_personal.loc[df_gc_personal["area_imputacion"]==unidad,"total"].sum()
-        dpp_gc = DPP_GC_MIS_PER[unidad]
-        label_gc = f"{unidad} - GC Misiones Personal"
-        actualizar_misiones(label_gc, total_unidad, dpp_gc)
 
-    for unidad in ["VPD","VPO","VPF"]:
-        total_unidad = df_gc_miscons.loc[df_gc_miscons["area_imputacion"]==unidad,"total"].sum()
-        dpp_gc = DPP_GC_MIS_CONS[unidad]
-        label_gc = f"{unidad} - GC Misiones Consultores"
-        actualizar_misiones(label_gc, total_unidad, dpp_gc)
+def _leer_hoja_validada(ws, requeridas: list, numericas: set, permitidas: set=frozenset()):
+    """
+    Lee la hoja 'ws' (de un libro abierto en read_only) fila por fila,
+    validando contra el esquema mientras lee:
+    - el encabezado debe tener las columnas 'requeridas' (más las 'permitidas',
+      p.ej. derivadas), sin columnas desconocidas ni repetidas: si no, se
+      rechaza sin leer las filas;
+    - las celdas de 'numericas' deben ser números o estar vacías.
+    Las filas válidas se acumulan en bloques de BLOQUE_SUBIDA; la lectura se
+    corta al llegar a MAX_ERRORES_SUBIDA errores.
+    Retorna (DataFrame, []) o (None, [errores por fila]).
+    """
+    filas = ws.iter_rows(values_only=True)
+    encabezado = next(filas, None)
+    if encabezado is None:
+        return None, ["El archivo está vacío."]
+    # Las columnas vacías al final del encabezado se ignoran
+    while encabezado and encabezado[-1] is None:
+        encabezado = encabezado[:-1]
+    columnas = [str(col).strip() if col is not None else "" for col in encabezado]
+
+    errores = []
+    faltantes = [col for col in requeridas if col not in columnas]
+    if faltantes:
+        errores.append(f"Faltan las columnas: {', '.join(faltantes)}")
+    # Un encabezado vacío se nombra por su posición en la hoja
+    etiquetas = [col or f"columna {i} sin encabezado" for i, col in enumerate(columnas, start=1)]
+    desconocidas = [
+        etiqueta for col, etiqueta in zip(columnas, etiquetas)
+        if not col or (requeridas and col not in requeridas and col not in permitidas)
+    ]
+    if desconocidas:
+        errores.append(f"Columnas no reconocidas: {', '.join(desconocidas)}")
+    repetidas = sorted({col for col in columnas if col and columnas.count(col) > 1})
+    if repetidas:
+        errores.append(f"Columnas repetidas: {', '.join(repetidas)}")
+    if errores:
+        return None, errores
+
+    n = len(columnas)
+    indices_numericos = [(i, col) for i, col in enumerate(columnas) if col in numericas]
+    bloques, bloque = [], []
+    for numero_fila, fila in enumerate(filas, start=2):
+        fila = list(fila[:n]) + [None] * (n - len(fila))
+        if all(valor is None for valor in fila):
+            continue
+        for i, col in indices_numericos:
+            try:
+                fila[i] = _numero(fila[i])
+            except ValueError:
+                errores.append(f"Fila {numero_fila}, columna '{col}': '{fila[i]}' no es un número.")
+        if len(errores) >= MAX_ERRORES_SUBIDA:
+            errores.append(f"Se detuvo la lectura tras {MAX_ERRORES_SUBIDA} errores.")
+            return None, errores
+        if not errores:
+            bloque.append(fila)
+            if len(bloque) >= BLOQUE_SUBIDA:
+                bloques.append(pd.DataFrame(bloque, columns=columnas))
+                bloque = []
+    if errores:
+        return None, errores
+
+    if bloque or not bloques:
+        bloques.append(pd.DataFrame(bloque, columns=columnas))
+    df = pd.concat(bloques, ignore_index=True) if len(bloques) > 1 else bloques[0]
+    for col in numericas.intersection(columnas):
+        df[col] = pd.to_numeric(df[col])
+    return df, []
 
 
 ########################################
-# 5) Editar Tabla con Control de Rol
+# Importación masiva (un libro con las hojas de todas las áreas)
 ########################################
+# Tablas que se pueden importar de una vez y su esquema de cálculo
+ESQUEMAS_IMPORTACION = {**TABLAS_TOTALES, "com": "com", "gastos_centralizados": "gastos_centralizados"}
+
+
+def claves_hojas_libro(nombres) -> tuple[dict, list]:
+    """
+    Asocia las hojas de un libro a claves de session_state: una hoja
+    corresponde a una tabla si se llama como su clave o como su hoja en el
+    almacén (sin distinguir mayúsculas). Retorna ({clave: hoja}, [hojas ignoradas]).
+    """
+    por_nombre = {}
+    for clave in ESQUEMAS_IMPORTACION:
+        por_nombre[clave.lower()] = clave
+        por_nombre[HOJAS_EXCEL[clave].lower()] = clave
+    asociadas, ignoradas = {}, []
+    for nombre in nombres:
+        clave = por_nombre.get(str(nombre).strip().lower())
+        if clave is None or clave in asociadas:
+            ignoradas.append(nombre)
+        else:
+            asociadas[clave] = nombre
+    return asociadas, ignoradas
+
+
+def leer_libro_multiarea(archivo) -> tuple[dict, dict, list]:
+    """
+    Lee un libro con una hoja por tabla de área (ver claves_hojas_libro).
+    Cada hoja se valida contra la tabla actual de la sesión (esquema_subida).
+    El libro se abre una sola vez (read_only) y sus hojas se leen una tras
+    otra: descomprimir y parsear es trabajo de CPU con el GIL tomado, así que
+    repartirlo en hilos no lo acelera.
+    Retorna (tablas, errores por hoja, hojas ignoradas); 'tablas' solo tiene
+    las hojas sin errores.
+    """
+    try:
+        wb = load_workbook(archivo, read_only=True, data_only=True)
+    except Exception as e:
+        return {}, {"(libro)": [f"No se pudo abrir el archivo: {e}"]}, []
+
+    try:
+        asociadas, ignoradas = claves_hojas_libro(wb.sheetnames)
+        if not asociadas:
+            return {}, {"(libro)": ["Ninguna hoja corresponde a una tabla de área."]}, ignoradas
+
+        asegurar_tablas(list(asociadas))
+        tablas, errores = {}, {}
+        for clave, hoja in asociadas.items():
+            esquema = ESQUEMAS_IMPORTACION[clave]
+            requeridas, numericas = esquema_subida(st.session_state.get(clave), esquema)
+            derivadas = {col for col, _ in ESQUEMAS_CALCULO[esquema]["derivadas"]} if esquema else set()
+            df, errores_hoja = _leer_hoja_validada(wb[hoja], requeridas, numericas, derivadas)
+            if errores_hoja:
+                errores[hoja] = errores_hoja
+            else:
+                tablas[clave] = evaluar_esquema(df, esquema) if esquema else df
+    finally:
+        wb.close()
+    return tablas, errores, ignoradas
+
+
+def guardar_tablas_importadas(tablas: dict) -> bool:
+    """
+    Guarda todas las tablas importadas como una sola transacción: un único
+    lote de escritura sincrónico (lote_escritura(sincronico=True)) con las
+    tablas importadas y las dependientes propagadas, que verifica la versión
+    de cada hoja: si alguna cambió en el almacén desde que se leyó, no se
+    guarda ninguna. Solo retorna True cuando el lote ya está guardado; si no se
+    pudo guardar, restaura las tablas de la sesión (también las propagadas),
+    muestra el error y retorna False.
+    """
+    previas = {clave: st.session_state.get(clave) for clave in tablas}
+    sesion_previa = {clave: st.session_state[clave] for clave in HOJAS_EXCEL if clave in st.session_state}
+    huellas_previas = dict(st.session_state.get("_huellas_tablas", {}))
+    st.session_state.update(tablas)
+    try:
+        with lote_escritura(sincronico=True):
+            for clave, df in tablas.items():
+                guardar_tabla(df, HOJAS_EXCEL[clave], version_esperada=huella_contenido(previas[clave]))
+            propagar_cambios(list(tablas))
+    except Exception as e:
+        for clave in HOJAS_EXCEL:
+            if clave in sesion_previa:
+                st.session_state[clave] = sesion_previa[clave]
+            else:
+                st.session_state.pop(clave, None)
+        st.session_state["_huellas_tablas"] = huellas_previas
+        st.error(str(e) if isinstance(e, ConflictoVersionError) else f"No se pudo guardar: {e}")
+        return False
+    return True
+
+
+def panel_importacion_masiva():
+    """
+    Panel lateral (solo admin): importa en un paso el libro consolidado del
+    cierre de ciclo. Si alguna hoja tiene errores no se importa ninguna.
+    """
+    with st.sidebar.expander("Importación masiva"):
+        st.caption(
+            "Un libro con una hoja por tabla, llamada como la tabla "
+            "(p.ej. vpd_misiones, COM). Las demás hojas se ignoran."
+        )
+        archivo = st.file_uploader("Libro de todas las áreas", type=["xlsx"], key="importacion_masiva")
+        if archivo is None or not st.button("Importar libro"):
+            return
+        tablas, errores, ignoradas = leer_libro_multiarea(archivo)
+        if ignoradas:
+            st.info(f"Hojas ignoradas: {', '.join(map(str, ignoradas))}")
+        if errores:
+            st.error("El libro no se importó:\n\n" + "\n".join(
+                f"- **{hoja}**: {e}" for hoja, errores_hoja in errores.items() for e in errores_hoja
+            ))
+        elif guardar_tablas_importadas(tablas):
+            for clave in tablas:
+                st.session_state[f"_version_editor_{clave}"] = st.session_state.get(f"_version_editor_{clave}", 0) + 1
+            st.success(f"Se importaron {len(tablas)} tablas: {', '.join(HOJAS_EXCEL[c] for c in tablas)}.")
+
+
+@st.fragment
 def editar_tabla_section(
     titulo: str,
     df_original: pd.DataFrame,
     session_key: str,
     sheet_name: str,
-    calculo_fn=None,
+    esquema=None,
     mostrar_sum_misiones: bool=False,
     mostrar_valuebox_area: bool=False,
     dpp_value: float=None,
@@ -413,30 +1401,30 @@ def editar_tabla_section(
     """
     Muestra una sección con:
     - Título
-    - DataFrame original (opcionalmente con cálculo)
+    - DataFrame original (opcionalmente con el cálculo de ESQUEMAS_CALCULO[esquema])
     - Value boxes (suma total, dpp_value, diferencia)
     - Botón para subir un Excel y reemplazar tabla
     - Editor de celdas para usuarios con rol admin/editor
     - Botón Guardar / Cancelar
     - Descarga en Excel
+    Es un fragmento: editar celdas, subir un archivo o descargar solo vuelve a
+    ejecutar esta sección; al guardar se ejecuta la app completa (sincronización).
     """
     st.subheader(titulo)
 
-    # 1) Calcula si corresponde
-    if calculo_fn:
-        df_calc = calculo_fn(df_original.copy())
+    # 1) Calcula si corresponde (df_original es compartido: no se modifica)
+    if esquema:
+        df_calc = calcular_tabla(df_original, esquema)
     else:
-        df_calc = df_original.copy()
+        df_calc = df_original
 
-    # 2) Suma total
-    sum_total = 0
-    if "total" in df_calc.columns:
-        sum_total = df_calc["total"].sum()
+    # 2) Suma total (de la matriz de totales)
+    sum_total = total_tabla(session_key)
 
     # 3) Mostrar boxes por área
     if mostrar_valuebox_area:
         st.markdown("### Totales por Área de Imputación")
-        mostrar_value_boxes_por_area(df_calc, col_area="area_imputacion")
+        mostrar_value_boxes_por_area(session_key)
 
     # 4) Sumas de misiones
     if mostrar_sum_misiones and all(c in df_calc.columns for c in ["total_pasaje","total_alojamiento","total_perdiem_otros","total_movilidad"]):
@@ -450,10 +1438,7 @@ def editar_tabla_section(
     if dpp_value is not None:
         # Caso especial "pre_misiones_personal" (solo filas PRE)
         if sheet_name == "pre_misiones_personal":
-            if "area_imputacion" in df_calc.columns:
-                total_pre = df_calc.loc[df_calc["area_imputacion"]=="PRE","total"].sum()
-            else:
-                total_pre = 0
+            total_pre = total_tabla(session_key, area="PRE")
             diferencia = dpp_value - total_pre
 
             c1, c2, c3 = st.columns(3)
@@ -489,13 +1474,17 @@ def editar_tabla_section(
     if uploaded_file is not None:
         if can_edit:
             if st.button(f"Reemplazar tabla ({sheet_name})"):
-                df_subido = pd.read_excel(uploaded_file)
-                if calculo_fn:
-                    df_subido = calculo_fn(df_subido)
-                st.session_state[session_key] = df_subido
-                guardar_en_excel(df_subido, sheet_name)
-                st.success(f"¡Tabla en '{sheet_name}' reemplazada con éxito!")
-                st.rerun()
+                requeridas, numericas = esquema_subida(df_original, esquema)
+                derivadas = {col for col, _ in ESQUEMAS_CALCULO[esquema]["derivadas"]} if esquema else set()
+                df_subido, errores = leer_excel_validado(uploaded_file, requeridas, numericas, derivadas)
+                if errores:
+                    st.error("El archivo no se cargó:\n\n" + "\n".join(f"- {e}" for e in errores))
+                else:
+                    if esquema:
+                        df_subido = calcular_tabla(df_subido, esquema)
+                    if guardar_tabla_editada(df_subido, df_original, session_key, sheet_name):
+                        st.success(f"¡Tabla en '{sheet_name}' reemplazada con éxito!")
+                        st.rerun()
         else:
             st.warning("No tienes permiso para reemplazar la tabla.")
 
@@ -503,20 +1492,16 @@ def editar_tabla_section(
 
     # 8) Columnas calculadas -> disabled
     disabled_cols = {}
-    if calculo_fn == calcular_misiones:
-        disabled_cols = {
-            "total_pasaje":        st.column_config.NumberColumn(disabled=True),
-            "total_alojamiento":   st.column_config.NumberColumn(disabled=True),
-            "total_perdiem_otros": st.column_config.NumberColumn(disabled=True),
-            "total_movilidad":     st.column_config.NumberColumn(disabled=True),
-            "total":               st.column_config.NumberColumn(disabled=True),
-        }
-    elif calculo_fn == calcular_consultores:
+    if esquema:
         disabled_cols = {
-            "total": st.column_config.NumberColumn(disabled=True)
+            col: st.column_config.NumberColumn(disabled=True)
+            for col, _ in ESQUEMAS_CALCULO[esquema]["derivadas"]
         }
 
-    # 9) Editor
+    # 9) Editor (con clave propia: sus cambios se leen como deltas por fila;
+    # la versión cambia al guardar o descartar para empezar de cero)
+    version_editor = st.session_state.setdefault(f"_version_editor_{session_key}", 0)
+    clave_editor = f"editor_{session_key}_{version_editor}"
     if not can_edit:
         st.warning("No tienes permiso para editar esta tabla (solo lectura).")
         df_editado = st.data_editor(
@@ -529,7 +1514,8 @@ def editar_tabla_section(
         df_editado = st.data_editor(
             df_calc,
             use_container_width=True,
-            column_config=disabled_cols
+            column_config=disabled_cols,
+            key=clave_editor
         )
 
     # 10) Guardar / Cancelar
@@ -537,22 +1523,22 @@ def editar_tabla_section(
         col_guardar, col_cancelar = st.columns(2)
         with col_guardar:
             if st.button("Guardar Cambios"):
-                # Se aplica el cálculo si corresponde
-                if calculo_fn:
-                    df_final = calculo_fn(df_editado)
-                else:
-                    df_final = df_editado
-                st.session_state[session_key] = df_final
-                guardar_en_excel(df_final, sheet_name)
-                # Actualiza integralmente todas las tablas y value boxes
-                sincronizar_actualizacion_al_iniciar()
-                st.success(f"¡Datos guardados en '{sheet_name}' y sincronizados!")
-                st.rerun()
+                # Solo las filas tocadas: se recalculan y se guardan como parche
+                cambios = st.session_state.get(clave_editor, {})
+                df_final, df_filas = aplicar_cambios_editor(df_original, cambios, esquema)
+                if df_filas is not None and df_filas.empty:
+                    st.info("No hay cambios para guardar.")
+                # Actualiza las tablas que dependen de esta y los value boxes
+                elif guardar_tabla_editada(df_final, df_original, session_key, sheet_name, df_filas):
+                    st.session_state[f"_version_editor_{session_key}"] += 1
+                    st.success(f"¡Datos guardados en '{sheet_name}' y sincronizados!")
+                    st.rerun()
 
         with col_cancelar:
             if st.button("Cancelar / Descartar Cambios"):
                 st.info("Descartando cambios y recargando la tabla original...")
-                st.rerun()
+                st.session_state[f"_version_editor_{session_key}"] += 1
+                st.rerun(scope="fragment")
 
     # 11) Descargar
     st.write("### Descargar la tabla en Excel (versión actual en pantalla)")
@@ -583,20 +1569,164 @@ def get_allowed_sections(area_user: str):
         return ["Página Principal", "Consolidado"]
 
 
+# Tablas que usa cada sección: se cargan recién cuando se abre la sección
+DEPENDENCIAS_SECCION = {
+    "Página Principal": [],
+    "VPD": ["vpd_misiones","vpd_consultores","dpp_metas"],
+    "VPO": ["vpo_misiones","vpo_consultores","dpp_metas"],
+    "VPF": ["vpf_misiones","vpf_consultores","dpp_metas"],
+    "VPE": ["vpe_misiones","vpe_consultores","dpp_metas"],
+    "PRE": ["pre_misiones_personal","pre_misiones_consultores","pre_consultores",
+            "com","gastos_centralizados","dpp_metas"],
+    "Actualización": DEPENDENCIAS_SYNC,
+    # El consolidado se deriva de las tablas de actualización: necesita sus fuentes
+    "Consolidado": DEPENDENCIAS_SYNC + ["cuadro_9","cuadro_10","cuadro_11","consolidado_df","filas_destacadas"],
+}
+
+# Secciones que muestran las hojas de actualización o el consolidado: al
+# abrirlas (o al recargarse alguna de sus fuentes) se propagan los cambios
+SECCIONES_SINCRONIZADAS = {"Actualización", "Consolidado"}
+
+
+def descargar_paquete_completo(secciones: list):
+    """
+    Botón lateral para descargar en un solo libro todas las tablas de las
+    'secciones' (las permitidas al usuario), incluido el Consolidado.
+    El libro se genera al hacer clic, con los cambios pendientes ya guardados.
+    """
+    claves = list(dict.fromkeys(c for seccion in secciones for c in DEPENDENCIAS_SECCION[seccion]))
+
+    def generar():
+        obtener_cola_escritura().esperar(timeout=30)
+        return exportar_paquete_excel(claves)
+
+    st.sidebar.download_button(
+        label="Descargar paquete completo (Excel)",
+        data=generar,
+        file_name="presupuesto_completo.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+
+
 ########################################
-# 7) Función para resaltar filas específicas (Consolidado)
+# 7) Cuadros del Consolidado (filas resaltadas y render en caché)
 ########################################
+def cuadros_consolidado() -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    (consolidado, cuadro_9) de la sesión, al día con sus tablas de actualización.
+    Una hoja base nueva se verifica contra las tablas de actualización
+    persistidas (con las que se guardó); si el almacén aún no las tiene,
+    contra las de la sesión.
+    """
+    motor = st.session_state.setdefault("_motor_consolidado", MotorConsolidado())
+    sesion = {hoja: st.session_state.get(hoja) for hoja in HOJAS_ACTUALIZACION}
+    persistidas, _ = obtener_tablas_compartidas(HOJAS_ACTUALIZACION)
+    fuentes = {hoja: df if not df.empty else sesion[hoja] for hoja, df in persistidas.items()}
+    return motor.actualizar(
+        st.session_state.get("consolidado_df"),
+        st.session_state.get("cuadro_9"),
+        sesion,
+        fuentes_base=fuentes,
+    )
+
+
+def sincronizar_consolidado():
+    """
+    Nodo "consolidado" del grafo de tablas: deriva el consolidado y el cuadro 9
+    y guarda lo que difiera de su versión persistida, para que el libro siga
+    al día con sus fuentes (y la verificación de la próxima carga coincida).
+    """
+    consolidado, cuadro_9 = cuadros_consolidado()
+    if consolidado is None:
+        return
+    persistidas, _ = obtener_tablas_compartidas(["consolidado_df","cuadro_9"])
+    nuevas = {"consolidado_df": consolidado}
+    if cuadro_9 is not None:
+        nuevas["cuadro_9"] = cuadro_9
+    reemplazos, filas = cambios_tablas(nuevas, persistidas)
+    for clave, df in reemplazos.items():
+        guardar_tabla(df, HOJAS_EXCEL[clave])
+    for clave, df_filas in filas.items():
+        guardar_filas(df_filas, HOJAS_EXCEL[clave])
+
+
+def aviso_discrepancias_consolidado():
+    """Avisa qué celdas no coinciden con sus tablas de origen (se muestran como están en el libro)."""
+    motor = st.session_state.get("_motor_consolidado")
+    if motor is None or not motor.discrepancias:
+        return
+    st.warning(
+        "Algunas celdas no coinciden con sus tablas de origen y se muestran tal como están "
+        "en el libro (no se actualizan automáticamente):\n\n" + "\n".join(
+            f"- **{fila}** / {columna}: libro {guardado:,.3f}, origen {derivado:,.3f}"
+            for fila, columna, guardado, derivado in motor.discrepancias[:20]
+        )
+    )
+
+
 def highlight_custom_rows(styler, rows_to_highlight: list):
     """
     Dado un Styler, aplica color de celda (#a4161a) y texto blanco
     en las filas indicadas por 'rows_to_highlight' (índices 0-based).
+    Los estilos se arman de una vez para toda la tabla (sin recorrer filas).
     """
-    def highlight_row(row):
-        if row.name in rows_to_highlight:
-            return ['background-color: #a4161a; color: white'] * len(row)
-        else:
-            return [''] * len(row)
-    return styler.apply(highlight_row, axis=1)
+    df = styler.data
+    estilos = pd.DataFrame("", index=df.index, columns=df.columns)
+    estilos.loc[df.index.isin(rows_to_highlight), :] = "background-color: #a4161a; color: white"
+    return styler.apply(lambda _: estilos, axis=None)
+
+
+def filas_destacadas(clave: str) -> list:
+    """
+    Filas a resaltar del cuadro 'clave', según la hoja 'filas_destacadas'
+    (columnas "Cuadro" = nombre de la hoja, "Fila" = índice 0-based).
+    Si la hoja falta, las de FILAS_DESTACADAS_INICIALES.
+    """
+    df = st.session_state.get("filas_destacadas")
+    if df is None or not {"Cuadro","Fila"} <= set(df.columns):
+        return FILAS_DESTACADAS_INICIALES.get(HOJAS_EXCEL[clave], [])
+    filas = pd.to_numeric(df.loc[df["Cuadro"] == HOJAS_EXCEL[clave], "Fila"], errors="coerce")
+    return sorted(filas.dropna().astype(int))
+
+
+@st.cache_resource
+def obtener_cache_render():
+    """HTML ya formateado de los cuadros del Consolidado, único por proceso."""
+    return CacheLRU(capacidad=16)
+
+
+def html_cuadro(df: pd.DataFrame, filas: list) -> str:
+    """
+    HTML del cuadro con 2 decimales y filas resaltadas. Se genera una vez por
+    versión de los datos (huella exacta de la tabla y filas resaltadas).
+    """
+    def generar():
+        cols_texto = df.columns.difference(df.select_dtypes(include=["float","int"]).columns)
+        styler = two_decimals_only_numeric(df).format(na_rep="", subset=cols_texto)
+        if filas:
+            styler = highlight_custom_rows(styler, filas)
+        styler = styler.set_table_styles([
+            {"selector": "", "props": "border-collapse: collapse; width: 100%; font-size: 14px;"},
+            {"selector": "th, td", "props": "border: 1px solid #e6e6e6; padding: 4px 8px;"},
+        ])
+        return styler.to_html()
+    return obtener_cache_render().obtener((huella_exacta(df), tuple(filas)), generar)
+
+
+@st.fragment
+def mostrar_cuadro(titulo: str, clave: str, caption: str=None, df: pd.DataFrame=None):
+    """
+    Muestra un cuadro del Consolidado (HTML en caché) y su descarga.
+    'df' es la versión derivada del cuadro (por defecto, la hoja de la sesión).
+    Es un fragmento: descargar un cuadro no vuelve a ejecutar la app completa.
+    """
+    st.write(f"#### {titulo}")
+    if df is None:
+        df = st.session_state[clave]
+    st.markdown(html_cuadro(df, filas_destacadas(clave)), unsafe_allow_html=True)
+    if caption:
+        st.caption(caption)
+    descargar_excel(df, file_name=f"{HOJAS_EXCEL[clave]}.xlsx")
 
 
 ########################################
@@ -672,7 +1802,7 @@ def pagina_instrucciones():
 
         **3.3 Edición de Datos (roles admin/editor)**  
         - Entra a la sub-sección “DPP 2025” (p.ej., “VPD > Misiones > DPP 2025”).  
-        - Haz clic en una celda y edítala. Después presiona **Enter** o haz clic fuera para confirmar. (Se debe de tomar en cuenta que se debe actualizar tres veces la tabla para actualizar los montos con todas las tablas relacionadas)
+        - Haz clic en una celda y edítala. Después presiona **Enter** o haz clic fuera para confirmar. Al guardar, los montos se actualizan de una sola vez en todas las tablas relacionadas (Actualización y Consolidado).
         - Botón “Guardar Cambios” o “Cancelar / Descartar Cambios”.  
         - También puedes **subir un Excel** propio (mismo formato) para reemplazar la tabla.
 
@@ -684,6 +1814,10 @@ def pagina_instrucciones():
 
         **3.6 Sección “Consolidado”**  
         - Cuadros globales (Cuadro 9, 10, 11, etc.) y el “DPP 2025 – Consolidado” final.
+        - Las misiones y consultorías de cada vicepresidencia (y de Gastos Centralizados PRE)
+          toman el Monto DPP 2025 de las tablas de Actualización, y con ellas se recalculan los totales.
+        - Si una celda del libro no coincide con su tabla de origen, se muestra tal como está
+          y se avisa arriba de los cuadros (no se actualiza automáticamente).
 
         **3.7 Cierre de Sesión**  
         - Haz clic en “Logout” (botón en el menú lateral) para cerrar sesión.
@@ -700,13 +1834,18 @@ def pagina_instrucciones():
 
         3. **¿Dónde se guardan los datos?**  
            - En `main_bdd.xlsx`, cada hoja corresponde a una sección.  
+           - Si el servidor usa el almacén SQLite, el administrador puede exportar/importar `main_bdd.xlsx` desde el menú lateral.  
+           - Al cierre de ciclo, el administrador puede cargar en un solo paso el libro con las hojas de todas las áreas (“Importación masiva” en el menú lateral); si una hoja tiene errores, no se importa ninguna.  
+           - Las tablas de actualización y el consolidado también se recalculan sin abrir la app (p.ej. en una tarea programada): `python presupuesto_nucleo.py --salida derivadas.xlsx`.  
+           - Los montos DPP 2025 de cada unidad están en la hoja `dpp_metas`; al modificarla, la app toma los nuevos montos sin reiniciarse. Si el libro no la tiene, se usan los montos iniciales hasta crearla con `python presupuesto_nucleo.py --migrar`.  
+           - Las filas resaltadas de los cuadros del Consolidado están en la hoja `filas_destacadas` (se crea con el mismo comando).  
            - Los usuarios en `config.yaml`.  
 
         4. **¿Puedo exportar la información?**  
            - Sí, hay un botón para descargar la tabla como Excel en cada sección.  
 
         5. **¿Qué pasa si subo un Excel con columnas distintas?**  
-           - Pueden surgir errores o datos incompletos. Respeta el formato original.
+           - El archivo se rechaza y la tabla no cambia. La app indica qué columnas faltan, cuáles no reconoce (incluidas las que no tienen encabezado, por su posición) o están repetidas, y en qué filas hay valores no numéricos en columnas numéricas. Las columnas calculadas (totales) pueden venir o no: se recalculan.
 
         ---
 
@@ -746,14 +1885,8 @@ def main():
         formulario_crear_usuario()
         return
 
-    # Caso "Login"
-    config = cargar_config_desde_yaml("config.yaml")
-    authenticator = stauth.Authenticate(
-        config['credentials'],
-        config['cookie']['name'],
-        config['cookie']['key'],
-        config['cookie']['expiry_days']
-    )
+    # Caso "Login" (config y authenticator en caché; se recargan si cambia config.yaml)
+    authenticator, config = obtener_autenticador("config.yaml")
 
     try:
         authenticator.login()
@@ -772,77 +1905,56 @@ def main():
         rol_user = config["credentials"]["usernames"][username_log].get("role", "viewer")
         st.session_state["user_role"] = rol_user
         area_user = config["credentials"]["usernames"][username_log].get("area", "PRE")
+        st.session_state["user_area"] = area_user
 
         st.write(f"Bienvenido(a) *{st.session_state['name']}*. Rol: **{rol_user}**, Área: **{area_user}**")
 
         # Botón Logout
         authenticator.logout()
 
-        # Carga de datos Excel en st.session_state
-        excel_file = "main_bdd.xlsx"
-
-        # Secciones VPD
-        if "vpd_misiones" not in st.session_state:
-            st.session_state["vpd_misiones"] = pd.read_excel(excel_file, sheet_name="vpd_misiones")
-        if "vpd_consultores" not in st.session_state:
-            st.session_state["vpd_consultores"] = pd.read_excel(excel_file, sheet_name="vpd_consultores")
-
-        # Secciones VPO
-        if "vpo_misiones" not in st.session_state:
-            st.session_state["vpo_misiones"] = pd.read_excel(excel_file, sheet_name="vpo_misiones")
-        if "vpo_consultores" not in st.session_state:
-            st.session_state["vpo_consultores"] = pd.read_excel(excel_file, sheet_name="vpo_consultores")
-
-        # Secciones VPF
-        if "vpf_misiones" not in st.session_state:
-            st.session_state["vpf_misiones"] = pd.read_excel(excel_file, sheet_name="vpf_misiones")
-        if "vpf_consultores" not in st.session_state:
-            st.session_state["vpf_consultores"] = pd.read_excel(excel_file, sheet_name="vpf_consultores")
-
-        # Secciones VPE
-        if "vpe_misiones" not in st.session_state:
-            st.session_state["vpe_misiones"] = pd.read_excel(excel_file, sheet_name="vpe_misiones")
-        if "vpe_consultores" not in st.session_state:
-            st.session_state["vpe_consultores"] = pd.read_excel(excel_file, sheet_name="vpe_consultores")
-
-        # Sección PRE
-        if "pre_misiones_personal" not in st.session_state:
-            st.session_state["pre_misiones_personal"] = pd.read_excel(excel_file, sheet_name="pre_misiones_personal")
-        if "pre_misiones_consultores" not in st.session_state:
-            st.session_state["pre_misiones_consultores"] = pd.read_excel(excel_file, sheet_name="pre_misiones_consultores")
-        if "pre_consultores" not in st.session_state:
-            st.session_state["pre_consultores"] = pd.read_excel(excel_file, sheet_name="pre_consultores")
-
-        # Otras hojas
-        if "com" not in st.session_state:
-            try:
-                st.session_state["com"] = pd.read_excel(excel_file, sheet_name="COM")
-            except:
-                st.warning("No se encontró la hoja COM. Se crea un DataFrame vacío.")
-                st.session_state["com"] = pd.DataFrame()
-
-        if "cuadro_9" not in st.session_state:
-            st.session_state["cuadro_9"] = pd.read_excel(excel_file, sheet_name="cuadro_9")
-        if "cuadro_10" not in st.session_state:
-            st.session_state["cuadro_10"] = pd.read_excel(excel_file, sheet_name="cuadro_10")
-        if "cuadro_11" not in st.session_state:
-            st.session_state["cuadro_11"] = pd.read_excel(excel_file, sheet_name="cuadro_11")
-        if "consolidado_df" not in st.session_state:
-            st.session_state["consolidado_df"] = pd.read_excel(excel_file, sheet_name="consolidado")
-
-        if "gastos_centralizados" not in st.session_state:
-            try:
-                st.session_state["gastos_centralizados"] = pd.read_excel(excel_file, sheet_name="gastos_centralizados")
-            except:
-                st.session_state["gastos_centralizados"] = pd.DataFrame()
+        # Estado de los guardados en segundo plano
+        mostrar_estado_guardado()
+        if rol_user == "admin":
+            panel_usuarios_admin()
+            panel_historial_admin()
+            panel_importacion_masiva()
+            stats = obtener_cache_calculos().estadisticas()
+            st.sidebar.caption(
+                f"Caché de cálculos: {stats['aciertos']} aciertos, "
+                f"{stats['fallos']} fallos, {stats['entradas']} tablas"
+            )
 
-        # Sincroniza (esto se ejecuta también al guardar cambios en cada sección)
-        sincronizar_actualizacion_al_iniciar()
+        # Importar / exportar main_bdd.xlsx cuando los datos viven en SQLite
+        almacen = obtener_almacen()
+        if rol_user == "admin" and isinstance(almacen, AlmacenSQLite):
+            with st.sidebar.expander("Almacén de datos (SQLite)"):
+                if st.button(f"Exportar a {EXCEL_FILE}"):
+                    obtener_cola_escritura().esperar()
+                    exportar_a_excel(almacen, EXCEL_FILE)
+                    st.success(f"Datos exportados a '{EXCEL_FILE}'.")
+                if st.button(f"Importar desde {EXCEL_FILE}"):
+                    obtener_cola_escritura().esperar()
+                    importar_desde_excel(almacen, EXCEL_FILE)
+                    if obtener_diario() is not None:
+                        obtener_diario().tomar_instantanea(almacen.leer_hojas(almacen.hojas()))
+                    st.success(f"Datos importados desde '{EXCEL_FILE}'.")
+                    st.rerun()
 
         # Menú principal filtrado por área
         allowed_sections = get_allowed_sections(area_user)
         st.sidebar.title("Navegación principal")
         eleccion_principal = st.sidebar.selectbox("Selecciona una sección:", allowed_sections)
+        descargar_paquete_completo(allowed_sections)
+
+        # Tablas de la sección: referencias a la caché de proceso (solo lectura).
+        # Se cargan al abrir la sección y solo se reemplazan las que cambiaron.
+        recargadas = asegurar_tablas(DEPENDENCIAS_SECCION[eleccion_principal])
+
+        # Si se (re)cargó alguna fuente, recalcula lo que depende de ella en
+        # una sola pasada (al guardar, lo hace guardar_tabla_editada)
+        if recargadas and eleccion_principal in SECCIONES_SINCRONIZADAS:
+            with lote_escritura():
+                propagar_cambios(recargadas)
 
         # ---------------------------
         # SECCIÓN: PÁGINA PRINCIPAL
@@ -857,7 +1969,7 @@ def main():
                - En secciones "DPP 2025", puedes editar celdas o subir Excel.
             3. **Actualización y Consolidado:**  
                - "Actualización": totales vs. Monto DPP 2025.
-               - "Consolidado": cuadros finales (9,10,11) y tabla final.
+               - "Consolidado": cuadros finales (9,10,11) y tabla final, con los montos DPP 2025 (las ediciones de las áreas se ven en "Actualización").
             4. **Crear usuario (opcional):**  
                - En el menú “Crear Usuario” (si tienes rol admin).
             5. **Cerrar Sesión:**  
@@ -881,7 +1993,7 @@ def main():
                     st.subheader("VPD > Misiones > Requerimiento del Área (solo lectura)")
                     df_req = st.session_state["vpd_misiones"]
                     if "total" in df_req.columns:
-                        sum_total = df_req["total"].sum()
+                        sum_total = total_tabla("vpd_misiones", medida="requerimiento")
                         value_box("Suma del total", f"{sum_total:,.2f}")
                     st.dataframe(df_req)
                 else:
@@ -890,10 +2002,10 @@ def main():
                         df_original=st.session_state["vpd_misiones"],
                         session_key="vpd_misiones",
                         sheet_name="vpd_misiones",
-                        calculo_fn=calcular_misiones,
+                        esquema="misiones",
                         mostrar_sum_misiones=True,
                         mostrar_valuebox_area=False,
-                        dpp_value=168000,
+                        dpp_value=meta_dpp_seccion("vpd_misiones"),
                         subir_archivo_label="Reemplazar la tabla de VPD Misiones"
                     )
             else:  # Consultorías
@@ -901,7 +2013,7 @@ def main():
                     st.subheader("VPD > Consultorías > Requerimiento del Área (solo lectura)")
                     df_req = st.session_state["vpd_consultores"]
                     if "total" in df_req.columns:
-                        sum_total = df_req["total"].sum()
+                        sum_total = total_tabla("vpd_consultores", medida="requerimiento")
                         value_box("Suma del total", f"{sum_total:,.2f}")
                     st.dataframe(df_req)
                 else:
@@ -910,10 +2022,10 @@ def main():
                         df_original=st.session_state["vpd_consultores"],
                         session_key="vpd_consultores",
                         sheet_name="vpd_consultores",
-                        calculo_fn=calcular_consultores,
+                        esquema="consultores",
                         mostrar_sum_misiones=False,
                         mostrar_valuebox_area=False,
-                        dpp_value=130000,
+                        dpp_value=meta_dpp_seccion("vpd_consultores"),
                         subir_archivo_label="Reemplazar la tabla de VPD Consultorías"
                     )
 
@@ -933,7 +2045,7 @@ def main():
                     st.subheader("VPO > Misiones > Requerimiento del Área (solo lectura)")
                     df_req = st.session_state["vpo_misiones"]
                     if "total" in df_req.columns:
-                        total_sum = df_req["total"].sum()
+                        total_sum = total_tabla("vpo_misiones", medida="requerimiento")
                         value_box("Suma del total", f"{total_sum:,.2f}")
                     st.dataframe(df_req)
                 else:
@@ -942,10 +2054,10 @@ def main():
                         df_original=st.session_state["vpo_misiones"],
                         session_key="vpo_misiones",
                         sheet_name="vpo_misiones",
-                        calculo_fn=calcular_misiones,
+                        esquema="misiones",
                         mostrar_sum_misiones=True,
                         mostrar_valuebox_area=False,
-                        dpp_value=434707,
+                        dpp_value=meta_dpp_seccion("vpo_misiones"),
                         subir_archivo_label="Reemplazar la tabla de VPO Misiones"
                     )
             else:  # Consultorías
@@ -953,7 +2065,7 @@ def main():
                     st.subheader("VPO > Consultorías > Requerimiento del Área (solo lectura)")
                     df_req = st.session_state["vpo_consultores"]
                     if "total" in df_req.columns:
-                        total_sum = df_req["total"].sum()
+                        total_sum = total_tabla("vpo_consultores", medida="requerimiento")
                         value_box("Suma del total", f"{total_sum:,.2f}")
                     st.dataframe(df_req)
                 else:
@@ -962,10 +2074,10 @@ def main():
                         df_original=st.session_state["vpo_consultores"],
                         session_key="vpo_consultores",
                         sheet_name="vpo_consultores",
-                        calculo_fn=calcular_consultores,
+                        esquema="consultores",
                         mostrar_sum_misiones=False,
                         mostrar_valuebox_area=False,
-                        dpp_value=250000,
+                        dpp_value=meta_dpp_seccion("vpo_consultores"),
                         subir_archivo_label="Reemplazar la tabla de VPO Consultorías"
                     )
 
@@ -985,7 +2097,7 @@ def main():
                     st.subheader("VPF > Misiones > Requerimiento del Área (solo lectura)")
                     df_req = st.session_state["vpf_misiones"]
                     if "total" in df_req.columns:
-                        total_sum = df_req["total"].sum()
+                        total_sum = total_tabla("vpf_misiones", medida="requerimiento")
                         value_box("Suma del total", f"{total_sum:,.2f}")
                     st.dataframe(df_req)
                 else:
@@ -994,10 +2106,10 @@ def main():
                         df_original=st.session_state["vpf_misiones"],
                         session_key="vpf_misiones",
                         sheet_name="vpf_misiones",
-                        calculo_fn=calcular_misiones,
+                        esquema="misiones",
                         mostrar_sum_misiones=True,
                         mostrar_valuebox_area=False,
-                        dpp_value=138600,
+                        dpp_value=meta_dpp_seccion("vpf_misiones"),
                         subir_archivo_label="Reemplazar la tabla de VPF Misiones"
                     )
             else:  # Consultorías
@@ -1005,7 +2117,7 @@ def main():
                     st.subheader("VPF > Consultorías > Requerimiento del Área (solo lectura)")
                     df_req = st.session_state["vpf_consultores"]
                     if "total" in df_req.columns:
-                        total_sum = df_req["total"].sum()
+                        total_sum = total_tabla("vpf_consultores", medida="requerimiento")
                         value_box("Suma del total", f"{total_sum:,.2f}")
                     st.dataframe(df_req)
                 else:
@@ -1014,10 +2126,10 @@ def main():
                         df_original=st.session_state["vpf_consultores"],
                         session_key="vpf_consultores",
                         sheet_name="vpf_consultores",
-                        calculo_fn=calcular_consultores,
+                        esquema="consultores",
                         mostrar_sum_misiones=False,
                         mostrar_valuebox_area=False,
-                        dpp_value=200000,
+                        dpp_value=meta_dpp_seccion("vpf_consultores"),
                         subir_archivo_label="Reemplazar la tabla de VPF Consultorías"
                     )
 
@@ -1037,7 +2149,7 @@ def main():
                     st.subheader("VPE > Misiones > Requerimiento del Área (Solo lectura)")
                     df_req = st.session_state["vpe_misiones"]
                     if "total" in df_req.columns:
-                        total_sum = df_req["total"].sum()
+                        total_sum = total_tabla("vpe_misiones", medida="requerimiento")
                         value_box("Suma del total", f"{total_sum:,.2f}")
                     st.dataframe(df_req)
                 else:
@@ -1046,10 +2158,10 @@ def main():
                         df_original=st.session_state["vpe_misiones"],
                         session_key="vpe_misiones",
                         sheet_name="vpe_misiones",
-                        calculo_fn=None,
+                        esquema=None,
                         mostrar_sum_misiones=False,
                         mostrar_valuebox_area=False,
-                        dpp_value=28244,
+                        dpp_value=meta_dpp_seccion("vpe_misiones"),
                         subir_archivo_label="Reemplazar tabla de VPE Misiones"
                     )
             else:  # Consultorías
@@ -1057,7 +2169,7 @@ def main():
                     st.subheader("VPE > Consultorías > Requerimiento del Área (Solo lectura)")
                     df_req = st.session_state["vpe_consultores"]
                     if "total" in df_req.columns:
-                        total_sum = df_req["total"].sum()
+                        total_sum = total_tabla("vpe_consultores", medida="requerimiento")
                         value_box("Suma del total", f"{total_sum:,.2f}")
                     st.dataframe(df_req)
                 else:
@@ -1066,10 +2178,10 @@ def main():
                         df_original=st.session_state["vpe_consultores"],
                         session_key="vpe_consultores",
                         sheet_name="vpe_consultores",
-                        calculo_fn=None,
+                        esquema=None,
                         mostrar_sum_misiones=False,
                         mostrar_valuebox_area=False,
-                        dpp_value=179446,
+                        dpp_value=meta_dpp_seccion("vpe_consultores"),
                         subir_archivo_label="Reemplazar tabla de VPE Consultorías"
                     )
 
@@ -1088,9 +2200,9 @@ def main():
                     st.subheader("PRE > Misiones Personal > Requerimiento del Área (Solo lectura)")
                     df_pre = st.session_state["pre_misiones_personal"]
                     if "total" in df_pre.columns:
-                        sum_total = df_pre["total"].sum()
+                        sum_total = total_tabla("pre_misiones_personal", medida="requerimiento")
                         value_box("Suma del total", f"{sum_total:,.2f}")
-                    mostrar_value_boxes_por_area(df_pre, col_area="area_imputacion")
+                    mostrar_value_boxes_por_area("pre_misiones_personal", medida="requerimiento")
                     st.dataframe(df_pre)
                 else:
                     editar_tabla_section(
@@ -1098,10 +2210,10 @@ def main():
                         df_original=st.session_state["pre_misiones_personal"],
                         session_key="pre_misiones_personal",
                         sheet_name="pre_misiones_personal",
-                        calculo_fn=calcular_misiones,
+                        esquema="misiones",
                         mostrar_sum_misiones=True,
                         mostrar_valuebox_area=True,
-                        dpp_value=80248,
+                        dpp_value=meta_dpp_seccion("pre_misiones_personal"),
                         subir_archivo_label="Reemplazar tabla de PRE Misiones Personal"
                     )
 
@@ -1112,9 +2224,9 @@ def main():
                     st.subheader("PRE > Misiones Consultores > Requerimiento del Área (Solo lectura)")
                     df_pre = st.session_state["pre_misiones_consultores"]
                     if "total" in df_pre.columns:
-                        sum_total = df_pre["total"].sum()
+                        sum_total = total_tabla("pre_misiones_consultores", medida="requerimiento")
                         value_box("Suma del total", f"{sum_total:,.2f}")
-                    mostrar_value_boxes_por_area(df_pre, col_area="area_imputacion")
+                    mostrar_value_boxes_por_area("pre_misiones_consultores", medida="requerimiento")
                     st.dataframe(df_pre)
                 else:
                     editar_tabla_section(
@@ -1122,10 +2234,10 @@ def main():
                         df_original=st.session_state["pre_misiones_consultores"],
                         session_key="pre_misiones_consultores",
                         sheet_name="pre_misiones_consultores",
-                        calculo_fn=calcular_misiones,
+                        esquema="misiones",
                         mostrar_sum_misiones=True,
                         mostrar_valuebox_area=True,
-                        dpp_value=30872,
+                        dpp_value=meta_dpp_seccion("pre_misiones_consultores"),
                         subir_archivo_label="Reemplazar tabla de PRE Misiones Consultores"
                     )
 
@@ -1136,10 +2248,11 @@ def main():
                     st.subheader("PRE > Consultorías > Requerimiento del Área (Solo lectura)")
                     df_pre = st.session_state["pre_consultores"]
                     if "total" in df_pre.columns:
-                        df_pre["total"] = pd.to_numeric(df_pre["total"], errors="coerce")
-                        sum_total = df_pre["total"].sum()
+                        # Copia local para mostrar: la tabla de la sesión es compartida (solo lectura)
+                        df_pre = df_pre.assign(total=pd.to_numeric(df_pre["total"], errors="coerce"))
+                        sum_total = total_tabla("pre_consultores", medida="requerimiento")
                         value_box("Suma del total", f"{sum_total:,.2f}")
-                    mostrar_value_boxes_por_area(df_pre, col_area="area_imputacion")
+                    mostrar_value_boxes_por_area("pre_consultores", medida="requerimiento")
                     st.dataframe(df_pre)
                 else:
                     editar_tabla_section(
@@ -1147,45 +2260,50 @@ def main():
                         df_original=st.session_state["pre_consultores"],
                         session_key="pre_consultores",
                         sheet_name="pre_consultores",
-                        calculo_fn=calcular_consultores,
+                        esquema="consultores",
                         mostrar_sum_misiones=False,
                         mostrar_valuebox_area=True,
-                        dpp_value=338372,  # 307528 + extras, ajusta si fuera necesario
+                        dpp_value=meta_dpp_seccion("pre_consultores"),
                         subir_archivo_label="Reemplazar tabla de PRE Consultorías"
                     )
 
             elif eleccion_pre_ == "Comunicaciones":
                 st.subheader("PRE > Comunicaciones (Solo lectura)")
-                df_com = st.session_state["com"]
+                df_com = calcular_tabla(st.session_state["com"], "com")
                 st.dataframe(df_com)
                 st.info("Tabla de Comunicaciones (COM) mostrada aquí.")
 
             else:
                 st.subheader("PRE > Gastos Centralizados (Referencias)")
                 st.write("### Copia: Misiones Personal (cálculo DPP)")
-                df_mp = calcular_misiones(st.session_state["pre_misiones_personal"].copy())
+                df_mp = calcular_tabla(st.session_state["pre_misiones_personal"], "misiones")
                 st.dataframe(df_mp)
 
                 st.write("### Copia: Misiones Consultores (cálculo DPP)")
-                df_mc = calcular_misiones(st.session_state["pre_misiones_consultores"].copy())
+                df_mc = calcular_tabla(st.session_state["pre_misiones_consultores"], "misiones")
                 st.dataframe(df_mc)
 
                 st.write("### Copia: Consultorías (cálculo DPP)")
-                df_c = calcular_consultores(st.session_state["pre_consultores"].copy())
+                df_c = calcular_tabla(st.session_state["pre_consultores"], "consultores")
                 st.dataframe(df_c)
 
+                df_gc = st.session_state["gastos_centralizados"]
+                if not df_gc.empty:
+                    st.write("### Gastos Centralizados (total planificado)")
+                    st.dataframe(calcular_tabla(df_gc, "gastos_centralizados"))
+
         # ---------------------------------------------------------
         # SECCIÓN ACTUALIZACIÓN
         # ---------------------------------------------------------
         elif eleccion_principal == "Actualización":
             st.title("Actualización")
-            st.write("Estas tablas se sincronizan automáticamente al iniciar la app o al guardar cambios.")
+            st.write("Estas tablas se sincronizan automáticamente al abrir esta sección o al guardar cambios.")
             st.write("### Tabla de Misiones")
             df_misiones = st.session_state["actualizacion_misiones"]
             st.dataframe(
                 df_misiones.style
                 .format("{:,.2f}", subset=["Requerimiento del Área","Monto DPP 2025","Diferencia"], na_rep="")
-                .applymap(color_diferencia, subset=["Diferencia"])
+                .map(color_diferencia, subset=["Diferencia"])
             )
 
             st.write("### Tabla de Consultorías")
@@ -1193,9 +2311,18 @@ def main():
             st.dataframe(
                 df_cons.style
                 .format("{:,.2f}", subset=["Requerimiento del Área","Monto DPP 2025","Diferencia"], na_rep="")
-                .applymap(color_diferencia, subset=["Diferencia"])
+                .map(color_diferencia, subset=["Diferencia"])
+            )
+            st.info("Se recalculan al abrir esta sección y cuando guardas datos en las secciones DPP 2025.")
+
+            st.write("### Totales por tabla y área de imputación (cálculo DPP)")
+            df_totales = matriz_totales()["calculado"].unstack("area", fill_value=0)
+            df_totales = df_totales.reindex(
+                columns=AREAS_IMPUTACION + [c for c in df_totales.columns if c not in AREAS_IMPUTACION],
+                fill_value=0,
             )
-            st.info("Se recalculan en cada carga de la app y cuando guardas datos en las secciones DPP 2025.")
+            df_totales["Total"] = df_totales.sum(axis=1)
+            st.dataframe(two_decimals_only_numeric(df_totales))
 
         # ---------------------------------------------------------
         # SECCIÓN CONSOLIDADO
@@ -1203,42 +2330,30 @@ def main():
         elif eleccion_principal == "Consolidado":
             st.title("Consolidado")
 
-            filas_destacadas_10 = [0,7,14,24,27]  
-            filas_destacadas_11 = [28]           
-            filas_destacadas_consolidado = [0,5,6,7,15,16,22,23,30,31,32,40,41,42,46,47,48]
+            # Consolidado y cuadro 9 derivados de las tablas de actualización
+            # (solo se recalculan las celdas cuyo origen cambió)
+            consolidado, cuadro_9 = cuadros_consolidado()
+            aviso_discrepancias_consolidado()
+            st.caption(
+                "Las misiones y consultorías de cada vicepresidencia se publican con su "
+                "Monto DPP 2025 (hoja dpp_metas), no con lo que piden las áreas: editar una "
+                "tabla de área no cambia el Consolidado; modificar una meta DPP sí."
+            )
 
-            # CUADRO 9
-            st.write("#### Gasto en personal 2024 Vs 2025 (Cuadro 9)")
-            df_9 = st.session_state["cuadro_9"]
-            df_9_styled = two_decimals_only_numeric(df_9)
-            st.table(df_9_styled)
-            st.caption("Cuadro 9 - DPP 2025")
+            # Cada cuadro es un fragmento independiente
+            mostrar_cuadro("Gasto en personal 2024 Vs 2025 (Cuadro 9)", "cuadro_9",
+                           caption="Cuadro 9 - DPP 2025", df=cuadro_9)
             st.write("---")
 
-            # CUADRO 10
-            st.write("#### Análisis de Cambios en Gastos de Personal 2025 vs. 2024 (Cuadro 10)")
-            df_10 = st.session_state["cuadro_10"]
-            df_10_styled = two_decimals_only_numeric(df_10)
-            df_10_styled = highlight_custom_rows(df_10_styled, filas_destacadas_10)
-            st.table(df_10_styled)
-            st.caption("Cuadro 10 - DPP 2025")
+            mostrar_cuadro("Análisis de Cambios en Gastos de Personal 2025 vs. 2024 (Cuadro 10)", "cuadro_10",
+                           caption="Cuadro 10 - DPP 2025")
             st.write("---")
 
-            # CUADRO 11
-            st.write("#### Gastos Operativos propuestos para 2025 vs. montos aprobados para 2024 (Cuadro 11)")
-            df_11 = st.session_state["cuadro_11"]
-            df_11_styled = two_decimals_only_numeric(df_11)
-            df_11_styled = highlight_custom_rows(df_11_styled, filas_destacadas_11)
-            st.table(df_11_styled)
-            st.caption("Cuadro 11 - DPP 2025")
+            mostrar_cuadro("Gastos Operativos propuestos para 2025 vs. montos aprobados para 2024 (Cuadro 11)", "cuadro_11",
+                           caption="Cuadro 11 - DPP 2025")
             st.write("---")
 
-            # CONSOLIDADO
-            st.write("#### DPP 2025 - Consolidado")
-            df_cons2 = st.session_state["consolidado_df"]
-            df_cons2_styled = two_decimals_only_numeric(df_cons2)
-            df_cons2_styled = highlight_custom_rows(df_cons2_styled, filas_destacadas_consolidado)
-            st.table(df_cons2_styled)
+            mostrar_cuadro("DPP 2025 - Consolidado", "consolidado_df", df=consolidado)
 
     elif st.session_state["authentication_status"] is False:
         st.error("Usuario/Contraseña incorrectos.")
@@ -0,0 +1,1733 @@
+"""
+Núcleo de cálculo del presupuesto, sin dependencias de Streamlit: esquemas de
+cálculo, almacén de datos (Excel o SQLite), diario de cambios, conciliación
+de las tablas de actualización y consolidado.
+
+Lo usa la app (centralizador-ppt.py) y también se puede ejecutar solo, para
+recalcular las tablas derivadas sin navegador (ver main):
+
+    python presupuesto_nucleo.py --salida derivadas.xlsx
+
+y para crear las hojas que falten en un libro anterior (ver migrar_hojas):
+
+    python presupuesto_nucleo.py --migrar
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from contextlib import contextmanager
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl   # POSIX
+except ImportError:
+    fcntl = None
+    import msvcrt  # Windows
+
+
+########################################
+# 1) Esquemas de cálculo y matriz de totales
+########################################
+def _primero_valido(*valores):
+    """Primer valor no nulo fila a fila (como fillna encadenado)."""
+    resultado = valores[0]
+    for valor in valores[1:]:
+        resultado = np.where(np.isnan(resultado), valor, resultado)
+    return resultado
+
+
+# Esquemas de cálculo por tipo de tabla: columnas de entrada y columnas
+# derivadas con su fórmula (en orden; una fórmula puede usar derivadas previas).
+# Las fórmulas reciben un dict columna -> arreglo float64 de NumPy.
+# Al cambiar una fórmula se incrementa "version" (invalida la caché de cálculos).
+ESQUEMAS_CALCULO = {
+    # Costo de misiones según cantidad de funcionarios, días, pasaje, etc.
+    "misiones": {
+        "version": 1,
+        "entradas": ["cant_funcionarios","costo_pasaje","dias","alojamiento","perdiem_otros","movilidad"],
+        "derivadas": [
+            ("total_pasaje",        lambda c: c["cant_funcionarios"] * c["costo_pasaje"]),
+            ("total_alojamiento",   lambda c: c["cant_funcionarios"] * c["dias"] * c["alojamiento"]),
+            ("total_perdiem_otros", lambda c: c["cant_funcionarios"] * c["dias"] * c["perdiem_otros"]),
+            ("total_movilidad",     lambda c: c["cant_funcionarios"] * c["movilidad"]),
+            ("total",               lambda c: c["total_pasaje"] + c["total_alojamiento"]
+                                              + c["total_perdiem_otros"] + c["total_movilidad"]),
+        ],
+    },
+    # Consultorías: cantidad_funcionarios * cantidad_meses * monto_mensual
+    "consultores": {
+        "version": 1,
+        "entradas": ["cantidad_funcionarios","cantidad_meses","monto_mensual"],
+        "derivadas": [
+            ("total", lambda c: c["cantidad_funcionarios"] * c["cantidad_meses"] * c["monto_mensual"]),
+        ],
+    },
+    # Comunicaciones (COM) comparte la fórmula de consultorías
+    "com": {
+        "version": 1,
+        "entradas": ["cantidad_funcionarios","cantidad_meses","monto_mensual"],
+        "derivadas": [
+            ("total", lambda c: c["cantidad_funcionarios"] * c["cantidad_meses"] * c["monto_mensual"]),
+        ],
+    },
+    # Gastos centralizados: filas de misiones o de consultorías en la misma hoja
+    "gastos_centralizados": {
+        "version": 1,
+        "entradas": ["Cantidad de Funcionarios","Días","Costo de Pasaje","Hospedaje",
+                     "Viaticos (per diem)","Movilidad","Nº consultores",
+                     "Monto mensual honorarios","cantidad meses"],
+        "derivadas": [
+            ("Total planificado", lambda c: _primero_valido(
+                c["Cantidad de Funcionarios"] * (
+                    c["Costo de Pasaje"]
+                    + c["Días"] * c["Hospedaje"]
+                    + c["Días"] * c["Viaticos (per diem)"]
+                    + c["Movilidad"]
+                ),
+                c["Nº consultores"] * c["Monto mensual honorarios"] * c["cantidad meses"],
+                0,
+            )),
+        ],
+    },
+}
+
+
+def evaluar_esquema(df: pd.DataFrame, esquema: str) -> pd.DataFrame:
+    """
+    Calcula las columnas derivadas de 'df' según ESQUEMAS_CALCULO[esquema],
+    en una sola pasada sobre arreglos NumPy. Las entradas faltantes valen 0 y
+    las no numéricas se convierten (lo inválido queda como NaN).
+    Si la tabla ya está limpia (entradas numéricas y derivadas al día) se
+    retorna el mismo DataFrame, sin copiar.
+    """
+    definicion = ESQUEMAS_CALCULO[esquema]
+    entradas = definicion["entradas"]
+    n = len(df)
+
+    valores = {}
+    faltantes = {}
+    convertidas = {}
+    for col in entradas:
+        if col not in df.columns:
+            faltantes[col] = 0
+            valores[col] = np.zeros(n)
+        elif pd.api.types.is_numeric_dtype(df[col]):
+            valores[col] = df[col].to_numpy(dtype="float64", na_value=np.nan)
+        else:
+            convertidas[col] = pd.to_numeric(df[col], errors="coerce")
+            valores[col] = convertidas[col].to_numpy(dtype="float64", na_value=np.nan)
+
+    derivadas = {}
+    for col, formula in definicion["derivadas"]:
+        valores[col] = derivadas[col] = np.broadcast_to(formula(valores), (n,))
+
+    # Entradas enteras (o faltantes) -> derivadas enteras, como en la hoja original
+    if all(col in faltantes or pd.api.types.is_integer_dtype(df[col]) for col in entradas):
+        derivadas = {col: v.astype("int64") for col, v in derivadas.items()}
+
+    limpio = not faltantes and not convertidas and all(
+        col in df.columns
+        and pd.api.types.is_numeric_dtype(df[col])
+        and np.array_equal(df[col].to_numpy(dtype="float64", na_value=np.nan), v, equal_nan=True)
+        for col, v in derivadas.items()
+    )
+    if limpio:
+        return df
+    return df.assign(**faltantes, **convertidas, **derivadas)
+
+
+def huella_exacta(df: pd.DataFrame) -> str:
+    """Huella de 'df' sensible a valores, tipos e índice (claves de caché)."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(list(zip(df.columns, df.dtypes.astype(str)))).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+class CacheLRU:
+    """
+    Caché LRU de resultados derivados de tablas, compartida por todas las
+    sesiones, con contadores de aciertos y fallos.
+    Los resultados son compartidos: no se deben modificar.
+    """
+
+    def __init__(self, capacidad: int=64):
+        self.capacidad = capacidad
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave, calcular_fn):
+        """Retorna el resultado de 'clave'; si no está, lo calcula con calcular_fn()."""
+        with self._lock:
+            if clave in self._entradas:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return self._entradas[clave]
+            self.fallos += 1
+        resultado = calcular_fn()
+        with self._lock:
+            self._entradas[clave] = resultado
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.capacidad:
+                self._entradas.popitem(last=False)
+        return resultado
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {"aciertos": self.aciertos, "fallos": self.fallos, "entradas": len(self._entradas)}
+
+
+# Tablas de las áreas que aportan a los totales: clave de sesión -> esquema
+# de cálculo (None: la tabla se usa tal cual, sin fórmulas)
+TABLAS_TOTALES = {
+    "vpd_misiones":             "misiones",
+    "vpd_consultores":          "consultores",
+    "vpo_misiones":             "misiones",
+    "vpo_consultores":          "consultores",
+    "vpf_misiones":             "misiones",
+    "vpf_consultores":          "consultores",
+    "vpe_misiones":             None,
+    "vpe_consultores":          None,
+    "pre_misiones_personal":    "misiones",
+    "pre_misiones_consultores": "misiones",
+    "pre_consultores":          "consultores",
+}
+
+AREAS_IMPUTACION = ["VPD","VPO","VPF","PRE"]
+SIN_AREA = "(sin área)"
+
+
+def calcular_matriz_totales(tablas: dict, calcular=evaluar_esquema) -> pd.DataFrame:
+    """
+    Totales de todas las tablas por área de imputación en un solo groupby.
+    Índice (tabla, área); columnas:
+    - 'requerimiento': suma de la columna 'total' tal como está en la hoja
+    - 'calculado': suma de 'total' según el esquema de cálculo de la tabla
+    Las filas sin área (o tablas sin esa columna) quedan en SIN_AREA.
+    'calcular(df, esquema)' aplica el esquema (la app pasa su versión con caché).
+    """
+    partes = []
+    for clave, df in tablas.items():
+        esquema = TABLAS_TOTALES.get(clave)
+        n = len(df)
+        if "total" in df.columns:
+            requerimiento = pd.to_numeric(df["total"], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        else:
+            requerimiento = np.full(n, np.nan)
+        calculado = (
+            calcular(df, esquema)["total"].to_numpy(dtype="float64", na_value=np.nan)
+            if esquema else requerimiento
+        )
+        area = df["area_imputacion"].to_numpy(dtype=object) if "area_imputacion" in df.columns else np.full(n, None)
+        partes.append(pd.DataFrame({
+            "tabla": clave, "area": area,
+            "requerimiento": requerimiento, "calculado": calculado,
+        }))
+    if not partes:
+        return pd.DataFrame(
+            columns=["requerimiento","calculado"],
+            index=pd.MultiIndex.from_arrays([[], []], names=["tabla","area"]),
+        )
+    filas = pd.concat(partes, ignore_index=True)
+    filas["area"] = filas["area"].fillna(SIN_AREA)
+    return filas.groupby(["tabla","area"], sort=False)[["requerimiento","calculado"]].sum()
+
+
+def total_matriz(matriz: pd.DataFrame, clave: str, area: str=None, medida: str="calculado") -> float:
+    """
+    Total de la tabla 'clave' en 'matriz' (de todas sus filas o solo de 'area').
+    Retorna 0 si no hay datos.
+    """
+    if clave not in matriz.index.get_level_values("tabla"):
+        return 0
+    por_area = matriz.loc[clave, medida]
+    if area is None:
+        return por_area.sum()
+    return por_area.get(area, 0)
+
+
+########################################
+# 2) Almacén de datos (Excel o SQLite)
+########################################
+EXCEL_FILE = "main_bdd.xlsx"
+
+# "excel": lee/escribe main_bdd.xlsx directamente (comportamiento histórico).
+# "sqlite": los datos viven en una base SQLite; main_bdd.xlsx queda solo
+#           para importar/exportar a pedido.
+BACKEND_ALMACEN = os.environ.get("PRESUPUESTO_ALMACEN", "excel")
+SQLITE_FILE     = os.environ.get("PRESUPUESTO_SQLITE", "main_bdd.sqlite")
+
+# Registro clave de session_state -> nombre de hoja en el libro
+HOJAS_EXCEL: dict[str, str] = {
+    "vpd_misiones":             "vpd_misiones",
+    "vpd_consultores":          "vpd_consultores",
+    "vpo_misiones":             "vpo_misiones",
+    "vpo_consultores":          "vpo_consultores",
+    "vpf_misiones":             "vpf_misiones",
+    "vpf_consultores":          "vpf_consultores",
+    "vpe_misiones":             "vpe_misiones",
+    "vpe_consultores":          "vpe_consultores",
+    "pre_misiones_personal":    "pre_misiones_personal",
+    "pre_misiones_consultores": "pre_misiones_consultores",
+    "pre_consultores":          "pre_consultores",
+    "com":                      "COM",
+    "cuadro_9":                 "cuadro_9",
+    "cuadro_10":                "cuadro_10",
+    "cuadro_11":                "cuadro_11",
+    "consolidado_df":           "consolidado",
+    "gastos_centralizados":     "gastos_centralizados",
+    "actualizacion_misiones":     "actualizacion_misiones",
+    "actualizacion_consultorias": "actualizacion_consultorias",
+    "dpp_metas":                "dpp_metas",
+    "filas_destacadas":         "filas_destacadas",
+}
+
+# Hojas que pueden faltar en el libro (se cargan como DataFrame vacío)
+HOJAS_OPCIONALES = {"com", "gastos_centralizados", "actualizacion_misiones", "actualizacion_consultorias", "dpp_metas",
+                    "filas_destacadas"}
+
+
+def leer_hojas_excel(hojas, excel_file: str=EXCEL_FILE) -> dict[str, pd.DataFrame]:
+    """
+    Lee en una sola pasada las hojas 'hojas' (nombres de hoja) de 'excel_file'.
+    El libro se abre una única vez en modo read_only, de modo que sharedStrings
+    y estilos se parsean una vez y no por cada hoja.
+    Las hojas inexistentes se omiten del resultado.
+    """
+    tablas = {}
+    with pd.ExcelFile(excel_file, engine="openpyxl") as libro:
+        hojas_existentes = set(libro.sheet_names)
+        for hoja in hojas:
+            if hoja in hojas_existentes:
+                tablas[hoja] = libro.parse(hoja)
+    return tablas
+
+
+_NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_REL  = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+
+
+def huellas_hojas_excel(excel_file: str=EXCEL_FILE) -> dict[str, str]:
+    """
+    Retorna {nombre_hoja: huella} leyendo solo el índice del zip (CRC32 y tamaño
+    del XML de cada worksheet), sin parsear celdas.
+    Permite saber qué hojas cambiaron desde la última lectura.
+    """
+    with zipfile.ZipFile(excel_file) as z:
+        infos = {info.filename: info for info in z.infolist()}
+        libro = ET.fromstring(z.read("xl/workbook.xml"))
+        rels  = ET.fromstring(z.read("xl/_rels/workbook.xml.rels"))
+
+    destinos = {rel.get("Id"): rel.get("Target", "") for rel in rels}
+    huellas = {}
+    for hoja in libro.iter(f"{_NS_MAIN}sheet"):
+        destino = destinos.get(hoja.get(f"{_NS_REL}id"), "")
+        ruta = destino.lstrip("/") if destino.startswith("/") else f"xl/{destino}"
+        info = infos.get(ruta)
+        if info is not None:
+            huellas[hoja.get("name")] = f"{info.CRC:08x}-{info.file_size}"
+    return huellas
+
+
+class ConflictoVersionError(Exception):
+    """La hoja cambió en el almacén desde que la sesión la leyó."""
+
+    def __init__(self, hoja: str):
+        super().__init__(
+            f"La hoja '{hoja}' fue modificada por otro usuario mientras la editabas. "
+            "Recarga la página para ver la versión actual antes de guardar."
+        )
+        self.hoja = hoja
+
+
+def huella_contenido(df: pd.DataFrame) -> str:
+    """
+    Huella barata del contenido de 'df' (columnas y valores, sin el índice).
+    Las columnas numéricas se comparan como float: 5 leído de Excel y 5.0
+    calculado en memoria dan la misma huella. Una columna object que ya solo
+    tiene números (p. ej. un texto reemplazado por un cálculo) cuenta como
+    numérica, igual que al volver a leerla del almacén.
+    """
+    df = df.infer_objects()
+    cols_num = df.select_dtypes(include=["number", "bool"]).columns
+    if len(cols_num):
+        df = df.astype({col: "float64" for col in cols_num})
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(list(df.columns)).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def verificar_versiones(tablas_actuales: dict[str, pd.DataFrame], versiones_esperadas: dict[str, str]):
+    """
+    Control optimista por hoja: lanza ConflictoVersionError si el contenido actual
+    de alguna hoja no coincide con la huella que la sesión tenía al leerla.
+    """
+    for hoja, esperada in versiones_esperadas.items():
+        df_actual = tablas_actuales.get(hoja)
+        actual = huella_contenido(df_actual) if df_actual is not None else None
+        if actual != esperada:
+            raise ConflictoVersionError(hoja)
+
+
+@contextmanager
+def bloqueo_archivo(ruta_lock: str):
+    """
+    Bloqueo exclusivo entre procesos (y entre hilos) sobre 'ruta_lock'.
+    Solo lo toman los escritores: los lectores nunca esperan.
+    """
+    with open(ruta_lock, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _reemplazar_hojas_atomico(hojas: dict[str, pd.DataFrame], excel_file: str):
+    """
+    Escribe las hojas en una copia temporal del libro (mismo directorio) y la
+    renombra sobre 'excel_file' con os.replace: un lector ve el libro anterior
+    o el nuevo completo, nunca uno a medio escribir. Requiere el bloqueo tomado.
+    """
+    directorio = os.path.dirname(os.path.abspath(excel_file))
+    fd, ruta_tmp = tempfile.mkstemp(prefix=".tmp_", suffix=".xlsx", dir=directorio)
+    os.close(fd)
+    try:
+        if os.path.exists(excel_file):
+            shutil.copy2(excel_file, ruta_tmp)
+            writer = pd.ExcelWriter(ruta_tmp, engine="openpyxl", mode="a", if_sheet_exists="replace")
+        else:
+            writer = pd.ExcelWriter(ruta_tmp, engine="openpyxl", mode="w")
+        with writer:
+            for sheet_name, df in hojas.items():
+                df.to_excel(writer, sheet_name=sheet_name, index=False)
+        os.replace(ruta_tmp, excel_file)
+    except BaseException:
+        if os.path.exists(ruta_tmp):
+            os.remove(ruta_tmp)
+        raise
+
+
+def guardar_hojas_en_excel(hojas: dict[str, pd.DataFrame], excel_file: str=EXCEL_FILE):
+    """
+    Reemplaza todas las hojas de 'hojas' ({sheet_name: df}) en un único ciclo
+    de apertura/guardado del libro, con bloqueo y reemplazo atómico.
+    Si el archivo no existe, lo crea.
+    """
+    if not hojas:
+        return
+    with bloqueo_archivo(f"{excel_file}.lock"):
+        _reemplazar_hojas_atomico(hojas, excel_file)
+
+
+def aplicar_filas(df: pd.DataFrame, df_filas: pd.DataFrame) -> pd.DataFrame:
+    """
+    Upsert en memoria: las filas de 'df_filas' (índice = posición de fila)
+    reemplazan o se agregan a 'df'. Las columnas nuevas se agregan al final.
+    Las columnas que no admiten los valores nuevos (p.ej. un decimal en una
+    columna entera) pasan al dtype común, ya que pandas no convierte al asignar.
+    """
+    df_res = df.reindex(
+        index=df.index.union(df_filas.index),
+        columns=df.columns.union(df_filas.columns, sort=False)
+    )
+    for col in df_filas.columns:
+        if df_res[col].dtype != df_filas[col].dtype:
+            comun = pd.concat([df_res[col].iloc[:0], df_filas[col].iloc[:0]]).dtype
+            if comun != df_res[col].dtype:
+                df_res[col] = df_res[col].astype(comun)
+    df_res.loc[df_filas.index, df_filas.columns] = df_filas
+    return df_res
+
+
+def filas_modificadas(df_nueva: pd.DataFrame, df_previa: pd.DataFrame):
+    """
+    Retorna las filas completas de 'df_nueva' que difieren de 'df_previa' o que
+    son nuevas, indexadas por posición (la clave de fila del almacén).
+    Retorna None si el cambio no se puede expresar como upsert de filas
+    (columnas distintas o filas eliminadas).
+    """
+    if df_previa is None or list(df_nueva.columns) != list(df_previa.columns):
+        return None
+    if len(df_nueva) < len(df_previa):
+        return None
+
+    nueva   = df_nueva.reset_index(drop=True)
+    previa  = df_previa.reset_index(drop=True)
+    comunes = nueva.iloc[:len(previa)]
+    distinta = np.zeros(len(previa), dtype=bool)
+    for col in nueva.columns:
+        a, b = comunes[col], previa[col]
+        if pd.api.types.is_numeric_dtype(a) and pd.api.types.is_numeric_dtype(b):
+            iguales = np.isclose(
+                a.to_numpy(dtype=float), b.to_numpy(dtype=float),
+                rtol=1e-9, atol=1e-6, equal_nan=True
+            )
+        else:
+            iguales = ((a == b) | (a.isna() & b.isna())).to_numpy()
+        distinta |= ~iguales
+
+    posiciones = list(np.flatnonzero(distinta)) + list(range(len(previa), len(nueva)))
+    return nueva.loc[posiciones]
+
+
+class AlmacenExcel:
+    """
+    Almacén sobre main_bdd.xlsx. Cada escritura reescribe el libro completo,
+    por eso las escrituras se agrupan en lotes (ver lote_escritura).
+    """
+
+    def __init__(self, excel_file: str=EXCEL_FILE):
+        self.excel_file = excel_file
+        self.identificador = f"excel:{os.path.abspath(excel_file)}"
+
+    def version(self):
+        """Marca barata para saber si algo cambió (mtime del libro)."""
+        return os.path.getmtime(self.excel_file)
+
+    def huellas(self) -> dict[str, str]:
+        return huellas_hojas_excel(self.excel_file)
+
+    def hojas(self) -> list:
+        return list(self.huellas())
+
+    def leer_hojas(self, hojas) -> dict[str, pd.DataFrame]:
+        return leer_hojas_excel(hojas, self.excel_file)
+
+    def escribir(
+        self,
+        reemplazos: dict[str, pd.DataFrame],
+        filas: dict[str, pd.DataFrame]=None,
+        versiones_esperadas: dict[str, str]=None
+    ):
+        """
+        Aplica reemplazos de hoja completa y upserts de filas en una sola escritura,
+        serializada entre procesos con un archivo .lock y reemplazo atómico.
+        'versiones_esperadas' ({hoja: huella_contenido}) se verifica bajo el bloqueo.
+        En Excel un upsert implica leer la hoja y reescribirla.
+        """
+        filas = filas or {}
+        versiones_esperadas = versiones_esperadas or {}
+        with bloqueo_archivo(f"{self.excel_file}.lock"):
+            a_leer = set(versiones_esperadas) | {hoja for hoja in filas if hoja not in reemplazos}
+            actuales = self.leer_hojas(sorted(a_leer)) if a_leer else {}
+            verificar_versiones(actuales, versiones_esperadas)
+
+            hojas = dict(reemplazos)
+            for hoja, df_filas in filas.items():
+                base = hojas.get(hoja, actuales.get(hoja, pd.DataFrame()))
+                hojas[hoja] = aplicar_filas(base, df_filas)
+            if hojas:
+                _reemplazar_hojas_atomico(hojas, self.excel_file)
+
+
+def _sql_id(nombre: str) -> str:
+    """Identificador SQL entre comillas (nombres de hoja/columna con espacios o tildes)."""
+    return '"' + str(nombre).replace('"', '""') + '"'
+
+
+def _valores_sql(df: pd.DataFrame) -> list:
+    """Filas de 'df' como tuplas de valores Python (NaN -> NULL)."""
+    df_obj = df.astype(object).where(df.notna(), None)
+    return list(df_obj.itertuples(index=False, name=None))
+
+
+class AlmacenSQLite:
+    """
+    Almacén sobre una base SQLite: una tabla por hoja con la columna "_fila"
+    (posición de la fila) como clave primaria, lo que permite upserts por fila.
+    La tabla "_versiones" guarda una versión por hoja, que cambia en cada escritura.
+    """
+
+    def __init__(self, ruta_db: str=SQLITE_FILE):
+        self.ruta_db = ruta_db
+        self.identificador = f"sqlite:{os.path.abspath(ruta_db)}"
+        with self._conexion() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("CREATE TABLE IF NOT EXISTS _versiones (hoja TEXT PRIMARY KEY, version TEXT)")
+
+    @contextmanager
+    def _conexion(self):
+        """Conexión que confirma (o revierte) al salir y siempre se cierra."""
+        con = sqlite3.connect(self.ruta_db, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def version(self):
+        with self._conexion() as con:
+            fila = con.execute("SELECT group_concat(hoja || '=' || version, ';') FROM _versiones").fetchone()
+        return fila[0]
+
+    def huellas(self) -> dict[str, str]:
+        with self._conexion() as con:
+            return dict(con.execute("SELECT hoja, version FROM _versiones").fetchall())
+
+    def hojas(self) -> list:
+        return list(self.huellas())
+
+    def vacio(self) -> bool:
+        return not self.huellas()
+
+    def leer_hojas(self, hojas) -> dict[str, pd.DataFrame]:
+        with self._conexion() as con:
+            return self._leer(con, hojas)
+
+    def _leer(self, con, hojas) -> dict[str, pd.DataFrame]:
+        existentes = {fila[0] for fila in con.execute("SELECT hoja FROM _versiones")}
+        tablas = {}
+        for hoja in hojas:
+            if hoja in existentes:
+                df = pd.read_sql_query(f"SELECT * FROM {_sql_id(hoja)} ORDER BY _fila", con)
+                df = df.drop(columns="_fila")
+                # NULL -> NaN, como al leer celdas vacías desde Excel
+                for col in df.columns[df.isna().all()]:
+                    df[col] = np.nan
+                tablas[hoja] = df.fillna(np.nan)
+        return tablas
+
+    def _crear_tabla(self, con, hoja: str, columnas):
+        con.execute(f"DROP TABLE IF EXISTS {_sql_id(hoja)}")
+        cols_sql = ", ".join(["_fila INTEGER PRIMARY KEY"] + [_sql_id(c) for c in columnas])
+        con.execute(f"CREATE TABLE {_sql_id(hoja)} ({cols_sql})")
+
+    def _insertar(self, con, hoja: str, df: pd.DataFrame, reemplazar: bool=False):
+        columnas = ["_fila"] + list(df.columns)
+        marcadores = ", ".join("?" * len(columnas))
+        verbo = "INSERT OR REPLACE" if reemplazar else "INSERT"
+        sql = f"{verbo} INTO {_sql_id(hoja)} ({', '.join(_sql_id(c) for c in columnas)}) VALUES ({marcadores})"
+        filas = [(int(pos),) + valores for pos, valores in zip(df.index, _valores_sql(df))]
+        con.executemany(sql, filas)
+
+    def _marcar_version(self, con, hoja: str):
+        con.execute(
+            "INSERT INTO _versiones (hoja, version) VALUES (?, ?) "
+            "ON CONFLICT(hoja) DO UPDATE SET version = excluded.version",
+            (hoja, uuid.uuid4().hex)
+        )
+
+    def escribir(
+        self,
+        reemplazos: dict[str, pd.DataFrame],
+        filas: dict[str, pd.DataFrame]=None,
+        versiones_esperadas: dict[str, str]=None
+    ):
+        """
+        Aplica reemplazos de hoja completa y upserts de filas en una sola transacción.
+        Un upsert solo toca las filas indicadas (su costo no depende del tamaño de la tabla).
+        BEGIN IMMEDIATE serializa a los escritores; con WAL los lectores no esperan.
+        'versiones_esperadas' ({hoja: huella_contenido}) se verifica dentro de la transacción.
+        """
+        with self._conexion() as con:
+            con.execute("BEGIN IMMEDIATE")
+            if versiones_esperadas:
+                verificar_versiones(self._leer(con, list(versiones_esperadas)), versiones_esperadas)
+            for hoja, df in reemplazos.items():
+                self._crear_tabla(con, hoja, df.columns)
+                self._insertar(con, hoja, df.reset_index(drop=True))
+                self._marcar_version(con, hoja)
+
+            for hoja, df_filas in (filas or {}).items():
+                existentes = [fila[1] for fila in con.execute(f"PRAGMA table_info({_sql_id(hoja)})")]
+                if not existentes:
+                    self._crear_tabla(con, hoja, df_filas.columns)
+                else:
+                    for col in df_filas.columns:
+                        if col not in existentes:
+                            con.execute(f"ALTER TABLE {_sql_id(hoja)} ADD COLUMN {_sql_id(col)}")
+                self._insertar(con, hoja, df_filas, reemplazar=True)
+                self._marcar_version(con, hoja)
+
+
+def importar_desde_excel(almacen, excel_file: str=EXCEL_FILE):
+    """
+    Copia todas las hojas de 'excel_file' al almacén (reemplazándolas).
+    """
+    tablas = pd.read_excel(excel_file, sheet_name=None, engine="openpyxl")
+    almacen.escribir(tablas)
+
+
+def exportar_a_excel(almacen, excel_file: str=EXCEL_FILE):
+    """
+    Escribe todas las tablas del almacén en 'excel_file' (una hoja por tabla).
+    Las hojas del libro que no están en el almacén se conservan.
+    """
+    guardar_hojas_en_excel(almacen.leer_hojas(almacen.hojas()), excel_file)
+
+
+def cargar_tablas(claves, almacen) -> dict[str, pd.DataFrame]:
+    """
+    Lee del almacén las tablas de 'claves' (claves de session_state) en una pasada.
+    Retorna {clave: DataFrame}; las hojas opcionales ausentes quedan vacías.
+    """
+    leidas = almacen.leer_hojas([HOJAS_EXCEL[clave] for clave in claves])
+    tablas = {}
+    for clave in claves:
+        hoja = HOJAS_EXCEL[clave]
+        if hoja in leidas:
+            tablas[clave] = leidas[hoja]
+        elif clave in HOJAS_OPCIONALES:
+            tablas[clave] = pd.DataFrame()
+        else:
+            raise ValueError(f"No se encontró la hoja '{hoja}' en el almacén de datos")
+    return tablas
+
+
+def crear_almacen(backend: str=BACKEND_ALMACEN, excel_file: str=EXCEL_FILE, ruta_db: str=SQLITE_FILE):
+    """
+    Almacén del backend indicado ("excel" o "sqlite").
+    Con SQLite, si la base está vacía se importa 'excel_file' la primera vez.
+    """
+    if backend == "sqlite":
+        almacen = AlmacenSQLite(ruta_db)
+        if almacen.vacio() and os.path.exists(excel_file):
+            importar_desde_excel(almacen, excel_file)
+        return almacen
+    return AlmacenExcel(excel_file)
+
+
+def tablas_iguales(df_a: pd.DataFrame, df_b: pd.DataFrame) -> bool:
+    """
+    Compara dos tablas por contenido (mismas columnas y valores), ignorando
+    el índice y diferencias de dtype (p.ej. int leído de Excel vs. float calculado).
+    """
+    if list(df_a.columns) != list(df_b.columns) or len(df_a) != len(df_b):
+        return False
+    try:
+        pd.testing.assert_frame_equal(
+            df_a.reset_index(drop=True),
+            df_b.reset_index(drop=True),
+            check_dtype=False,
+            rtol=1e-9,
+            atol=1e-6
+        )
+    except AssertionError:
+        return False
+    return True
+
+
+########################################
+# 3) Diario de cambios (append-only) e instantáneas
+########################################
+# Junto al almacén se lleva un diario de los cambios por fila (usuario, área,
+# hoja, fecha, valores anteriores y nuevos) en archivos JSON Lines a los que
+# solo se agrega al final. Cada DIARIO_COMPACTAR_CADA registros se guarda una
+# instantánea de todas las tablas y se abre un segmento nuevo: reconstruir una
+# tabla en cualquier instante es leer una instantánea y reproducir a lo sumo
+# un segmento. PRESUPUESTO_DIARIO vacío desactiva el diario.
+DIARIO_DIR = os.environ.get("PRESUPUESTO_DIARIO", "main_bdd.diario")
+DIARIO_COMPACTAR_CADA = int(os.environ.get("PRESUPUESTO_DIARIO_COMPACTAR", "500"))
+
+
+def _valor_json(valor):
+    """Valor de celda serializable en JSON (NaN -> None, escalares NumPy -> Python)."""
+    if isinstance(valor, np.generic):
+        valor = valor.item()
+    if valor is None or (isinstance(valor, float) and np.isnan(valor)):
+        return None
+    if hasattr(valor, "isoformat"):
+        return valor.isoformat()
+    if pd.isna(valor):
+        return None
+    return valor
+
+
+def _mismo_valor_json(a, b) -> bool:
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6)
+    return a == b
+
+
+def _registros_fila(previa: pd.DataFrame, nueva: pd.DataFrame, posiciones) -> list:
+    """
+    [(posición, antes, después)] de las filas 'posiciones' de 'nueva'. En filas
+    existentes solo van las celdas que cambiaron; en las nuevas, la fila
+    completa (antes = None). Las filas sin cambios no generan registro.
+    """
+    registros = []
+    columnas = list(nueva.columns)
+    for pos in posiciones:
+        despues = dict(zip(columnas, map(_valor_json, nueva.loc[pos].tolist())))
+        if previa is None or pos not in previa.index:
+            registros.append((int(pos), None, despues))
+            continue
+        antes = dict(zip(previa.columns, map(_valor_json, previa.loc[pos].tolist())))
+        distintas = [col for col in columnas if not _mismo_valor_json(antes.get(col), despues[col])]
+        if distintas:
+            registros.append((
+                int(pos),
+                {col: antes.get(col) for col in distintas},
+                {col: despues[col] for col in distintas},
+            ))
+    return registros
+
+
+def _aplicar_celdas(df: pd.DataFrame, celdas: dict) -> pd.DataFrame:
+    """Aplica {posición: {columna: valor}} a 'df' (agrega filas y columnas si hace falta)."""
+    if df is None:
+        df = pd.DataFrame()
+    columnas = list(dict.fromkeys(col for valores in celdas.values() for col in valores))
+    for col in columnas:
+        posiciones = [pos for pos in sorted(celdas) if col in celdas[pos]]
+        valores = pd.Series([celdas[pos][col] for pos in posiciones], index=posiciones)
+        df = aplicar_filas(df, valores.to_frame(col))
+    return df
+
+
+def reproducir_diario(tablas: dict, registros, hoja: str=None, hasta: float=None) -> dict:
+    """
+    Aplica los 'registros' del diario a 'tablas' ({hoja: DataFrame}) y retorna
+    las tablas resultantes. Con 'hoja' solo se reproduce esa hoja; con
+    'hasta', solo los registros con fecha <= 'hasta'. Las celdas se acumulan
+    por hoja y se aplican de una vez (un reemplazo de tabla las descarta).
+    """
+    tablas = dict(tablas)
+    pendientes = {}  # hoja -> {posición: {columna: valor}}
+    for registro in registros:
+        if hasta is not None and registro["t"] > hasta:
+            break
+        h = registro["h"]
+        if hoja is not None and h != hoja:
+            continue
+        if registro["op"] == "tabla":
+            pendientes.pop(h, None)
+            tablas[h] = pd.DataFrame(registro["filas"], columns=registro["columnas"])
+        else:
+            celdas = pendientes.setdefault(h, {}).setdefault(registro["f"], {})
+            celdas.update(registro["despues"])
+    for h, celdas in pendientes.items():
+        tablas[h] = _aplicar_celdas(tablas.get(h), celdas)
+    return tablas
+
+
+class DiarioCambios:
+    """
+    Diario append-only de los cambios por fila guardados en el almacén, con
+    instantáneas periódicas. Lo escribe la cola de escritura después de cada
+    escritura exitosa; entre procesos se serializa con un archivo .lock y cada
+    proceso se pone al día leyendo solo lo que otros agregaron al segmento.
+    Lo que se modifica fuera de la app (p.ej. editando el libro a mano) no
+    pasa por el diario: tras importar datos conviene tomar una instantánea.
+    """
+
+    def __init__(self, directorio: str, almacen, compactar_cada: int=DIARIO_COMPACTAR_CADA):
+        self.directorio = directorio
+        self.almacen = almacen
+        self.compactar_cada = compactar_cada
+        self._lock = threading.Lock()
+        self._tablas = None     # hoja -> DataFrame, estado al final del diario
+        self._segmento = None   # número de la última instantánea (y su segmento)
+        self._posicion = 0      # bytes del segmento ya aplicados
+        self._registros = 0     # registros en el segmento
+        self._instantaneas_leidas = CacheLRU(capacidad=4)
+        os.makedirs(directorio, exist_ok=True)
+        # La instantánea inicial debe ser anterior a la primera escritura
+        with self._bloqueo():
+            self._ponerse_al_dia()
+
+    def _ruta(self, nombre: str) -> str:
+        return os.path.join(self.directorio, nombre)
+
+    def _ruta_segmento(self, numero: int) -> str:
+        return self._ruta(f"segmento_{numero:06d}.jsonl")
+
+    def _ruta_instantanea(self, numero: int) -> str:
+        return self._ruta(f"instantanea_{numero:06d}.pkl.gz")
+
+    @contextmanager
+    def _bloqueo(self):
+        with self._lock, bloqueo_archivo(self._ruta(".lock")):
+            yield
+
+    def instantaneas(self) -> list[dict]:
+        """[{"n": número, "t": fecha}] de las instantáneas, en orden."""
+        ruta = self._ruta("instantaneas.jsonl")
+        if not os.path.exists(ruta):
+            return []
+        with open(ruta, encoding="utf-8") as f:
+            return [json.loads(linea) for linea in f if linea.strip()]
+
+    def _leer_instantanea(self, numero: int) -> dict:
+        return self._instantaneas_leidas.obtener(
+            numero, lambda: pd.read_pickle(self._ruta_instantanea(numero))["tablas"]
+        )
+
+    def _leer_segmento(self, numero: int, desde: int=0) -> tuple[list, int]:
+        """Registros del segmento a partir del byte 'desde' y la posición final."""
+        ruta = self._ruta_segmento(numero)
+        if not os.path.exists(ruta):
+            return [], desde
+        with open(ruta, "rb") as f:
+            f.seek(desde)
+            datos = f.read()
+        return [json.loads(linea) for linea in datos.splitlines() if linea.strip()], desde + len(datos)
+
+    def _escribir_instantanea(self, tablas: dict, instante: float):
+        """Nueva instantánea (y segmento vacío). Se llama con el bloqueo tomado."""
+        numero = (self._segmento or 0) + 1
+        temporal = self._ruta(f".tmp_instantanea_{numero:06d}.pkl.gz")
+        pd.to_pickle({"t": instante, "tablas": tablas}, temporal)
+        os.replace(temporal, self._ruta_instantanea(numero))
+        with open(self._ruta("instantaneas.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps({"n": numero, "t": instante}) + "\n")
+        self._tablas, self._segmento, self._posicion, self._registros = dict(tablas), numero, 0, 0
+
+    def _ponerse_al_dia(self):
+        """Carga la última instantánea y lo agregado a su segmento desde la última lectura."""
+        indice = self.instantaneas()
+        if not indice:
+            # Primera vez: la instantánea inicial es el contenido actual del almacén
+            self._escribir_instantanea(self.almacen.leer_hojas(self.almacen.hojas()), time.time())
+            return
+        ultima = indice[-1]["n"]
+        if ultima != self._segmento:
+            self._tablas, self._segmento = dict(self._leer_instantanea(ultima)), ultima
+            self._posicion, self._registros = 0, 0
+        registros, self._posicion = self._leer_segmento(ultima, self._posicion)
+        if registros:
+            self._tablas = reproducir_diario(self._tablas, registros)
+            self._registros += len(registros)
+
+    def registrar(self, reemplazos: dict, filas: dict, autores: dict=None):
+        """
+        Agrega al diario los cambios de una escritura ya persistida: reemplazos
+        de hoja completa y upserts de filas (los mismos argumentos de
+        almacen.escribir). 'autores' es {hoja: {"usuario", "area"}}.
+        """
+        autores = autores or {}
+        with self._bloqueo():
+            self._ponerse_al_dia()
+            ahora = time.time()
+            lineas = []
+            for hoja in sorted(set(reemplazos) | set(filas)):
+                previa = self._tablas.get(hoja)
+                nueva = reemplazos.get(hoja, previa)
+                if hoja in filas:
+                    nueva = aplicar_filas(nueva if nueva is not None else pd.DataFrame(), filas[hoja])
+                autor = autores.get(hoja) or {}
+                comun = {"t": ahora, "u": autor.get("usuario"), "a": autor.get("area"), "h": hoja}
+
+                if hoja in reemplazos:
+                    df_filas = filas_modificadas(nueva, previa)
+                    posiciones = None if df_filas is None else df_filas.index
+                else:
+                    posiciones = filas[hoja].index
+                if posiciones is None:
+                    # Filas eliminadas o columnas distintas: se registra la tabla completa
+                    lineas.append({**comun, "op": "tabla", "columnas": [str(c) for c in nueva.columns],
+                                   "filas": [list(map(_valor_json, fila)) for fila in nueva.itertuples(index=False)]})
+                else:
+                    lineas.extend(
+                        {**comun, "op": "fila", "f": pos, "antes": antes, "despues": despues}
+                        for pos, antes, despues in _registros_fila(previa, nueva, posiciones)
+                    )
+                self._tablas[hoja] = nueva
+
+            if lineas:
+                datos = "".join(json.dumps(l, ensure_ascii=False, separators=(",", ":")) + "\n" for l in lineas)
+                datos = datos.encode("utf-8")
+                with open(self._ruta_segmento(self._segmento), "ab") as f:
+                    f.write(datos)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._posicion += len(datos)
+                self._registros += len(lineas)
+            if self._registros >= self.compactar_cada:
+                self._escribir_instantanea(self._tablas, ahora)
+
+    def tomar_instantanea(self, tablas: dict=None):
+        """
+        Nueva instantánea de 'tablas' (por defecto, el estado del diario).
+        Sirve para compactar a pedido o tras importar datos por fuera de la app.
+        """
+        with self._bloqueo():
+            self._ponerse_al_dia()
+            self._escribir_instantanea(tablas if tablas is not None else self._tablas, time.time())
+
+    def tabla_en(self, hoja: str, instante: float) -> pd.DataFrame:
+        """
+        Hoja 'hoja' tal como estaba en 'instante' (segundos epoch): la última
+        instantánea anterior más su segmento hasta esa fecha. None si no existía.
+        """
+        anteriores = [i for i in self.instantaneas() if i["t"] <= instante]
+        if not anteriores:
+            return None
+        numero = anteriores[-1]["n"]
+        registros, _ = self._leer_segmento(numero)
+        tablas = {hoja: self._leer_instantanea(numero).get(hoja)}
+        return reproducir_diario(tablas, registros, hoja=hoja, hasta=instante)[hoja]
+
+    def historial(self, hoja: str=None, limite: int=50) -> pd.DataFrame:
+        """Últimos 'limite' cambios por fila (del segmento abierto), más recientes primero."""
+        indice = self.instantaneas()
+        registros, _ = self._leer_segmento(indice[-1]["n"]) if indice else ([], 0)
+        filas = [
+            {
+                "fecha": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r["t"])),
+                "usuario": r["u"], "area": r["a"], "hoja": r["h"],
+                "fila": r.get("f"), "antes": r.get("antes"),
+                "despues": r.get("despues") if r["op"] == "fila" else f"tabla completa ({len(r['filas'])} filas)",
+            }
+            for r in registros if hoja is None or r["h"] == hoja
+        ]
+        return pd.DataFrame(filas[::-1][:limite], columns=["fecha","usuario","area","hoja","fila","antes","despues"])
+
+
+########################################
+# 4) Tablas de actualización y metas DPP
+########################################
+COLUMNAS_ACTUALIZACION = ["Unidad Organizacional","Requerimiento del Área","Monto DPP 2025","Diferencia"]
+HOJAS_ACTUALIZACION = ["actualizacion_misiones", "actualizacion_consultorias"]
+
+
+def _mismo_valor(a, b) -> bool:
+    return (pd.isna(a) and pd.isna(b)) or a == b
+
+
+class LibroConciliacion:
+    """
+    Tabla de actualización (Requerimiento del Área vs Monto DPP 2025) indexada
+    por "Unidad Organizacional": cada registro es un upsert O(1) en un dict y
+    el DataFrame se materializa una sola vez al final. Sirve igual para
+    misiones y consultorías.
+    """
+
+    def __init__(self, df_base: pd.DataFrame=None):
+        self._filas = {}  # unidad -> (requerimiento, monto_dpp, diferencia), en orden
+        self._base = None
+        self.modificado = True
+        if df_base is not None and set(COLUMNAS_ACTUALIZACION) <= set(df_base.columns):
+            for fila in zip(*(df_base[col] for col in COLUMNAS_ACTUALIZACION)):
+                self._filas.setdefault(fila[0], fila[1:])
+            # Unidades repetidas o columnas extra: se reescribe la tabla limpia
+            self.modificado = (
+                len(self._filas) != len(df_base)
+                or list(df_base.columns) != COLUMNAS_ACTUALIZACION
+            )
+            self._base = df_base
+
+    def registrar(self, unidad: str, requerimiento: float, monto_dpp: float):
+        """Inserta o actualiza la fila de 'unidad' (la diferencia es DPP - requerimiento)."""
+        nueva = (requerimiento, monto_dpp, monto_dpp - requerimiento)
+        previa = self._filas.get(unidad)
+        if previa is None or not all(_mismo_valor(a, b) for a, b in zip(previa, nueva)):
+            self._filas[unidad] = nueva
+            self.modificado = True
+
+    def a_dataframe(self) -> pd.DataFrame:
+        """DataFrame con columnas COLUMNAS_ACTUALIZACION (la tabla base si nada cambió)."""
+        if not self.modificado:
+            return self._base
+        unidades = list(self._filas)
+        valores = list(zip(*self._filas.values())) or [(), (), ()]
+        return pd.DataFrame(
+            dict(zip(COLUMNAS_ACTUALIZACION, [unidades, *valores])),
+            columns=COLUMNAS_ACTUALIZACION,
+        )
+
+
+# La hoja tiene columnas "Tabla", "Unidad Organizacional" y "Monto DPP 2025".
+# "Tabla" es la hoja de actualización donde se concilia el monto, o "seccion"
+# para metas propias de una sección DPP 2025 (la unidad es la clave de la tabla).
+COLUMNAS_METAS_DPP = ["Tabla","Unidad Organizacional","Monto DPP 2025"]
+
+# Meta que muestra cada sección DPP 2025: (Tabla, Unidad Organizacional)
+METAS_SECCION = {
+    "vpd_misiones":             ("actualizacion_misiones",     "VPD"),
+    "vpd_consultores":          ("actualizacion_consultorias", "VPD"),
+    "vpo_misiones":             ("actualizacion_misiones",     "VPO"),
+    "vpo_consultores":          ("actualizacion_consultorias", "VPO"),
+    "vpf_misiones":             ("actualizacion_misiones",     "VPF"),
+    "vpf_consultores":          ("actualizacion_consultorias", "VPF"),
+    "vpe_misiones":             ("actualizacion_misiones",     "VPE"),
+    "vpe_consultores":          ("actualizacion_consultorias", "VPE"),
+    "pre_misiones_personal":    ("actualizacion_misiones",     "PRE - Misiones - Personal"),
+    "pre_misiones_consultores": ("actualizacion_misiones",     "PRE - Misiones - Consultores"),
+    "pre_consultores":          ("seccion",                    "pre_consultores"),
+}
+
+
+# Montos DPP 2025 con los que se crea la hoja (ver migrar_hojas). Son también
+# las metas vigentes mientras la hoja no exista en el almacén.
+METAS_DPP_INICIALES = [
+    ("actualizacion_misiones",     "VPD",                           168000),
+    ("actualizacion_misiones",     "VPO",                           434707),
+    ("actualizacion_misiones",     "VPF",                           138600),
+    ("actualizacion_misiones",     "VPE",                            28244),
+    ("actualizacion_misiones",     "PRE - Misiones - Personal",      80248),
+    ("actualizacion_misiones",     "PRE - Misiones - Consultores",   30872),
+    ("actualizacion_misiones",     "VPD - GC Misiones Personal",     35960),  # el del consolidado publicado
+    ("actualizacion_misiones",     "VPO - GC Misiones Personal",     48158),
+    ("actualizacion_misiones",     "VPF - GC Misiones Personal",     40960),
+    ("actualizacion_misiones",     "VPD - GC Misiones Consultores",  24200),
+    ("actualizacion_misiones",     "VPO - GC Misiones Consultores",  13160),
+    ("actualizacion_misiones",     "VPF - GC Misiones Consultores",  24200),
+    ("actualizacion_consultorias", "VPD",                           130000),
+    ("actualizacion_consultorias", "VPO",                           250000),
+    ("actualizacion_consultorias", "VPF",                           200000),
+    ("actualizacion_consultorias", "VPE",                           179446),
+    ("actualizacion_consultorias", "PRE - Consultorías",            307528),
+    ("actualizacion_consultorias", "VPD - Consultorías",            193160),
+    ("actualizacion_consultorias", "VPO - Consultorías",             33160),
+    ("actualizacion_consultorias", "VPF - Consultorías",             88480),
+    ("seccion",                    "pre_consultores",               338372),
+]
+
+
+def tabla_metas_iniciales() -> pd.DataFrame:
+    """Hoja 'dpp_metas' con los montos de METAS_DPP_INICIALES."""
+    return pd.DataFrame(METAS_DPP_INICIALES, columns=COLUMNAS_METAS_DPP)
+
+
+def metas_desde_tabla(df_metas: pd.DataFrame) -> dict:
+    """
+    Hoja 'dpp_metas' como dict (Tabla, Unidad Organizacional) -> monto (0 si no es número).
+    Si la hoja falta (o no tiene las columnas) se usan METAS_DPP_INICIALES, para
+    no conciliar contra metas en 0.
+    """
+    if df_metas is None or not set(COLUMNAS_METAS_DPP) <= set(df_metas.columns):
+        return {(tabla, unidad): monto for tabla, unidad, monto in METAS_DPP_INICIALES}
+    montos = pd.to_numeric(df_metas["Monto DPP 2025"], errors="coerce").fillna(0)
+    return dict(zip(zip(df_metas["Tabla"], df_metas["Unidad Organizacional"]), montos))
+
+
+def conciliar_actualizacion(
+    matriz: pd.DataFrame,
+    metas: dict,
+    presentes,
+    base_misiones: pd.DataFrame=None,
+    base_consultorias: pd.DataFrame=None
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Tablas 'actualizacion_misiones' y 'actualizacion_consultorias' conciliadas:
+    Requerimiento del Área (de la matriz de totales) contra Monto DPP 2025 (de
+    'metas'), partiendo de las tablas base. 'presentes' son las claves de las
+    tablas de área disponibles (las de VPD..VPE que falten no se registran).
+    Si nada cambió se retornan las mismas tablas base.
+    """
+    def total(clave, area=None):
+        return total_matriz(matriz, clave, area=area)
+
+    def meta(tabla, unidad):
+        return metas.get((tabla, unidad), 0)
+
+    misiones     = LibroConciliacion(base_misiones)
+    consultorias = LibroConciliacion(base_consultorias)
+
+    # Todos los totales salen de la matriz de totales (un solo groupby);
+    # VPE no tiene esquema de cálculo y se suma tal cual
+    for unidad in ["VPD","VPO","VPF","VPE"]:
+        if f"{unidad.lower()}_misiones" in presentes:
+            misiones.registrar(unidad, total(f"{unidad.lower()}_misiones"),
+                               meta("actualizacion_misiones", unidad))
+        if f"{unidad.lower()}_consultores" in presentes:
+            consultorias.registrar(unidad, total(f"{unidad.lower()}_consultores"),
+                                   meta("actualizacion_consultorias", unidad))
+
+    # PRE maneja "pre_misiones_personal", "pre_misiones_consultores" y "pre_consultores"
+    misiones.registrar("PRE - Misiones - Personal", total("pre_misiones_personal", "PRE"),
+                       meta("actualizacion_misiones", "PRE - Misiones - Personal"))
+    misiones.registrar("PRE - Misiones - Consultores", total("pre_misiones_consultores", "PRE"),
+                       meta("actualizacion_misiones", "PRE - Misiones - Consultores"))
+    consultorias.registrar("PRE - Consultorías", total("pre_consultores", "PRE"),
+                           meta("actualizacion_consultorias", "PRE - Consultorías"))
+
+    # Consultores de PRE imputados a cada vicepresidencia
+    for unidad in ["VPD","VPO","VPF"]:
+        etiqueta = f"{unidad} - Consultorías"
+        consultorias.registrar(etiqueta, total("pre_consultores", unidad),
+                               meta("actualizacion_consultorias", etiqueta))
+
+    # Gastos Centralizados
+    for unidad in ["VPD","VPO","VPF"]:
+        etiqueta = f"{unidad} - GC Misiones Personal"
+        misiones.registrar(etiqueta, total("pre_misiones_personal", unidad),
+                           meta("actualizacion_misiones", etiqueta))
+
+    for unidad in ["VPD","VPO","VPF"]:
+        etiqueta = f"{unidad} - GC Misiones Consultores"
+        misiones.registrar(etiqueta, total("pre_misiones_consultores", unidad),
+                           meta("actualizacion_misiones", etiqueta))
+
+    return misiones.a_dataframe(), consultorias.a_dataframe()
+
+
+def cambios_tablas(nuevas: dict, persistidas: dict) -> tuple[dict, dict]:
+    """
+    Lo que hay que escribir de las tablas derivadas 'nuevas' respecto de su
+    versión 'persistidas' (clave -> DataFrame o None): (reemplazos, filas),
+    con upsert de las filas modificadas o reemplazo de la hoja si cambió su
+    estructura. Las tablas iguales a lo persistido no se escriben.
+    """
+    reemplazos, filas = {}, {}
+    for hoja, df_nueva in nuevas.items():
+        df_previa = persistidas.get(hoja)
+        if df_previa is not None and tablas_iguales(df_nueva, df_previa):
+            continue
+        df_filas = filas_modificadas(df_nueva, df_previa)
+        if df_filas is None:
+            reemplazos[hoja] = df_nueva
+        elif not df_filas.empty:
+            filas[hoja] = df_filas
+    return reemplazos, filas
+
+
+########################################
+# 5) Consolidado y cuadro 9
+########################################
+# El consolidado y el cuadro 9 se derivan de las hojas del libro más las
+# tablas de actualización; el cuadro 10 (proyección salarial) y el cuadro 11
+# (detalle de gastos operativos) no tienen tablas de origen y se muestran tal cual.
+
+# Medida de las tablas de actualización que va al consolidado (en miles de US$):
+# el consolidado publica los montos DPP 2025, no lo que piden las áreas. Por
+# eso guardar una tabla de área no cambia el consolidado (solo la columna
+# "Requerimiento del Área" de actualización); lo cambia modificar una meta.
+MEDIDA_CONSOLIDADO = "Monto DPP 2025"
+ESCALA_CONSOLIDADO = 1000
+
+# Celdas del consolidado que salen de las tablas de actualización:
+# (bloque, fila) -> {columna: (hoja de actualización, Unidad Organizacional)}.
+# El bloque es el que cierra la fila "Total <bloque>". Las consultorías de
+# VPO y VPF no se derivan: en el libro están repartidas entre sus unidades.
+ORIGENES_CONSOLIDADO = {
+    ("VPE", "VICEPRESIDENCIA EJECUTIVA"): {
+        "Misiones de Servicio":              ("actualizacion_misiones",     "VPE"),
+        "Servicios Profesionales a Término": ("actualizacion_consultorias", "VPE"),
+    },
+    ("VPD", "VICEPRESIDENCIA DE DESARROLLO ESTRATÉGICO"): {
+        "Misiones de Servicio":              ("actualizacion_misiones",     "VPD"),
+        "Servicios Profesionales a Término": ("actualizacion_consultorias", "VPD"),
+    },
+    ("VPO", "VICEPRESIDENCIA DE OPERACIONES Y PAÍSES"): {
+        "Misiones de Servicio":              ("actualizacion_misiones",     "VPO"),
+    },
+    ("VPF", "VICEPRESIDENCIA DE FINANZAS"): {
+        "Misiones de Servicio":              ("actualizacion_misiones",     "VPF"),
+    },
+    ("VPD", "Gastos Centralizados PRE"): {
+        "Misiones de Servicio":              ("actualizacion_misiones",     "VPD - GC Misiones Personal"),
+        "Servicios Profesionales a Término": ("actualizacion_consultorias", "VPD - Consultorías"),
+    },
+    ("VPO", "Gastos Centralizados PRE"): {
+        "Misiones de Servicio":              ("actualizacion_misiones",     "VPO - GC Misiones Personal"),
+        "Servicios Profesionales a Término": ("actualizacion_consultorias", "VPO - Consultorías"),
+    },
+    ("VPF", "Gastos Centralizados PRE"): {
+        "Misiones de Servicio":              ("actualizacion_misiones",     "VPF - GC Misiones Personal"),
+        "Servicios Profesionales a Término": ("actualizacion_consultorias", "VPF - Consultorías"),
+    },
+}
+
+# Columnas calculadas de cada fila (en orden: cada una puede usar las anteriores)
+COLUMNAS_DERIVADAS_CONSOLIDADO = {
+    "Gastos en Personal": ["Salarios","Beneficios","PAC","Pasantías","Capacitación"],
+    "Total de Gastos":    ["Programa de Comunicaciones","Gastos Administrativos"],
+    "Total Presupuesto":  ["Gobernanza Institucional","Misiones de Servicio","Servicios Profesionales a Término",
+                           "Gastos en Personal","Total de Gastos"],
+}
+
+# Filas de resumen al pie (en orden). "Total del Presupuesto" es la suma de
+# las filas "Total <bloque>"; "Presupuestado 2024" y el ajuste por inflación son datos.
+FILA_AJUSTADA = "2024 Ajustado por inflación en US$ Interanual"
+FILAS_RESUMEN_CONSOLIDADO = {
+    "Incremento/(reducción)": lambda f: f["Total del Presupuesto"] - f["Presupuestado 2024"],
+    "Variación %":            lambda f: f["Incremento/(reducción)"] / f["Presupuestado 2024"],
+    "Variación":              lambda f: f["Total del Presupuesto"] - f[FILA_AJUSTADA],
+    "%":                      lambda f: f["Variación"] / f[FILA_AJUSTADA],
+}
+
+# Cuadro 9: fila -> columna del consolidado, tomada de la fila "Total <bloque>"
+# de cada vicepresidencia (columnas PRE, VPE, VPD, VPO, VPF del cuadro)
+FILAS_CUADRO_9 = {
+    "Posiciones":   "Posiciones",
+    "Salarios":     "Salarios",
+    "Beneficios":   "Beneficios",
+    "PAC":          "PAC",
+    "Pasantías":    "Pasantías",
+    "Capacitación": "Capacitación",
+    "Total 2025":   "Gastos en Personal",
+}
+FORMULAS_CUADRO_9 = {
+    "Subtotal":  lambda f: f["Salarios"] + f["Beneficios"] + f["PAC"],
+    "Variación": lambda f: f["Total 2025"] - f["Aprobado 2024"],
+    "%":         lambda f: f["Variación"] / f["Aprobado 2024"],
+}
+# Filas con participación sobre el "Total 2025" (columna "%")
+FILAS_PARTICIPACION_CUADRO_9 = ["Salarios","Beneficios","PAC","Pasantías","Capacitación"]
+
+# Filas resaltadas de cada cuadro (índice 0-based) con las que se crea la hoja
+# 'filas_destacadas' (ver migrar_hojas); se usan mientras la hoja no exista.
+FILAS_DESTACADAS_INICIALES = {
+    "cuadro_10":   [0,7,14,24,27],
+    "cuadro_11":   [28],
+    "consolidado": [0,5,6,7,15,16,22,23,30,31,32,40,41,42,46,47,48],
+}
+
+
+def tabla_filas_destacadas_iniciales() -> pd.DataFrame:
+    """Hoja 'filas_destacadas' (columnas "Cuadro", "Fila") con FILAS_DESTACADAS_INICIALES."""
+    return pd.DataFrame(
+        [(cuadro, fila) for cuadro, filas in FILAS_DESTACADAS_INICIALES.items() for fila in filas],
+        columns=["Cuadro","Fila"],
+    )
+
+
+def _etiquetas(serie: pd.Series) -> list:
+    return [str(v).strip() if pd.notna(v) else "" for v in serie]
+
+
+def _estructura_consolidado(df: pd.DataFrame) -> dict:
+    """
+    Grafo de dependencias del consolidado:
+    - bloques: bloque -> (fila "Total <bloque>", [filas del bloque])
+    - fila_bloque: fila -> bloque
+    - resumen: etiqueta -> fila, para las filas desde "Total del Presupuesto"
+    - origenes: [(fila, columna, hoja de actualización, unidad)]
+    """
+    bloques, fila_bloque, resumen, origenes = {}, {}, {}, []
+    filas_abiertas = []
+    en_resumen = False
+    for i, etiqueta in zip(df.index, _etiquetas(df.iloc[:, 0])):
+        if etiqueta == "Total del Presupuesto":
+            en_resumen = True
+        if en_resumen:
+            if etiqueta:
+                resumen.setdefault(etiqueta, i)
+        elif etiqueta.startswith("Total "):
+            bloque = etiqueta[len("Total "):]
+            bloques[bloque] = (i, [fila for fila, _ in filas_abiertas])
+            for fila, etiqueta_fila in filas_abiertas:
+                fila_bloque[fila] = bloque
+                for columna, (hoja, unidad) in ORIGENES_CONSOLIDADO.get((bloque, etiqueta_fila), {}).items():
+                    if columna in df.columns:
+                        origenes.append((fila, columna, hoja, unidad))
+            filas_abiertas = []
+        else:
+            filas_abiertas.append((i, etiqueta))
+    return {"bloques": bloques, "fila_bloque": fila_bloque, "resumen": resumen, "origenes": origenes}
+
+
+def _valores_actualizacion(df: pd.DataFrame) -> dict:
+    """Unidad Organizacional -> MEDIDA_CONSOLIDADO de una tabla de actualización."""
+    if df is None or not {"Unidad Organizacional", MEDIDA_CONSOLIDADO} <= set(df.columns):
+        return {}
+    return dict(zip(df["Unidad Organizacional"], pd.to_numeric(df[MEDIDA_CONSOLIDADO], errors="coerce")))
+
+
+def _mismo_monto(a, b) -> bool:
+    """
+    Igualdad de montos con la tolerancia de tablas_iguales (el libro guarda
+    valores con ruido de coma flotante); dos celdas vacías son iguales.
+    """
+    if pd.isna(a) or pd.isna(b):
+        return pd.isna(a) and pd.isna(b)
+    return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6)
+
+
+def _aplicar_formulas(df: pd.DataFrame, filas: dict, formulas: dict, columnas: list):
+    """
+    Evalúa 'formulas' (etiqueta -> lambda sobre las filas) en 'columnas' y
+    escribe el resultado en 'df'. 'filas' es etiqueta -> índice en 'df'.
+    """
+    valores = {etiqueta: df.loc[i, columnas].astype(float) for etiqueta, i in filas.items()}
+    for etiqueta, formula in formulas.items():
+        if etiqueta not in filas:
+            continue
+        try:
+            valores[etiqueta] = formula(valores)
+        except KeyError:  # falta una fila de la que depende
+            continue
+        df.loc[filas[etiqueta], columnas] = valores[etiqueta]
+
+
+class MotorConsolidado:
+    """
+    Deriva 'consolidado' y 'cuadro_9' de sus hojas base y de las tablas de
+    actualización. Conserva el último resultado: cuando cambia una tabla de
+    origen solo se recalculan las celdas que dependen de ella (la fila, el
+    total de su bloque, las filas de resumen y las columnas del cuadro 9 que
+    las usan). Las hojas base se tratan como solo lectura.
+
+    Antes de derivar sobre una hoja base nueva se verifica que, con las
+    fuentes con las que se guardó, la derivación devuelva la hoja tal cual:
+    las celdas de origen que no coinciden no se derivan (se muestran como
+    están en el libro) y quedan en 'discrepancias'.
+    """
+
+    def __init__(self):
+        self._base = None
+        self._base_cuadro_9 = None
+        self._estructura = None
+        self.consolidado = None
+        self.cuadro_9 = None
+        self.discrepancias = []
+        self.celdas_recalculadas = 0
+
+    def actualizar(
+        self,
+        consolidado: pd.DataFrame,
+        cuadro_9: pd.DataFrame,
+        tablas_actualizacion: dict,
+        fuentes_base: dict=None
+    ):
+        """
+        Retorna (consolidado, cuadro_9) al día con 'tablas_actualizacion' (hoja -> DataFrame).
+        'fuentes_base' son las tablas de actualización con las que se guardó la
+        hoja base (por defecto, las mismas 'tablas_actualizacion'); contra
+        ellas se verifica una hoja base nueva.
+        """
+        if consolidado is None or not set(COLUMNAS_DERIVADAS_CONSOLIDADO) <= set(consolidado.columns):
+            return consolidado, cuadro_9
+        if consolidado is not self._base:
+            # Hoja base nueva: se rearma el grafo, se verifica y el cuadro 9 se recalcula entero
+            self._base = self.consolidado = consolidado
+            self._estructura = _estructura_consolidado(consolidado)
+            self._base_cuadro_9 = None
+            self._verificar_base(fuentes_base if fuentes_base is not None else tablas_actualizacion)
+
+        bloques_modificados = self._recalcular_consolidado(tablas_actualizacion)
+
+        if cuadro_9 is None or not {"Item","Total","%"} <= set(cuadro_9.columns):
+            self._base_cuadro_9 = self.cuadro_9 = cuadro_9
+        elif cuadro_9 is not self._base_cuadro_9:
+            self._base_cuadro_9 = self.cuadro_9 = cuadro_9
+            self._recalcular_cuadro_9(list(self._estructura["bloques"]))
+            self._verificar_cuadro_9(cuadro_9)
+        else:
+            usadas = set(FILAS_CUADRO_9.values())
+            bloques = [bloque for bloque, columnas in bloques_modificados.items() if columnas & usadas]
+            if bloques:
+                self._recalcular_cuadro_9(bloques)
+        return self.consolidado, self.cuadro_9
+
+    def _verificar_base(self, fuentes: dict):
+        """
+        Deriva la hoja base desde 'fuentes' (todas las celdas de origen, como
+        si hubieran cambiado) y la compara con lo guardado. Las celdas de
+        origen distintas (o sin fuente) se quitan del grafo; si aun así la
+        derivación no reproduce la hoja (fórmulas que no coinciden), no se
+        deriva nada.
+        """
+        self.discrepancias = []
+        base = self._base
+        valores = self._valores_origen(fuentes)
+        origenes = []
+        for origen in self._estructura["origenes"]:
+            fila, columna = origen[:2]
+            valor = valores.get(origen)
+            if valor is None:
+                continue  # sin fuente no se puede verificar: la celda queda como está
+            if not _mismo_monto(base.at[fila, columna], valor):
+                self.discrepancias.append((base.iat[fila, 0], columna, base.at[fila, columna], valor))
+            else:
+                origenes.append(origen)
+        self._estructura["origenes"] = origenes
+
+        forzados = {}
+        for fila, columna, hoja, unidad in origenes:
+            forzados.setdefault(fila, {})[columna] = valores[(fila, columna, hoja, unidad)]
+        derivado, _ = self._propagar(base, forzados)
+        distintas = [
+            (base.iat[fila, 0], columna, base.at[fila, columna], derivado.at[fila, columna])
+            for columna in derivado.columns[1:]
+            if pd.api.types.is_numeric_dtype(derivado[columna])
+            for fila in derivado.index
+            if not _mismo_monto(base.at[fila, columna], derivado.at[fila, columna])
+        ]
+        if distintas:
+            self.discrepancias += distintas
+            self._estructura["origenes"] = []
+
+    def _verificar_cuadro_9(self, cuadro_9: pd.DataFrame):
+        """Si el cuadro 9 recalculado no coincide con el guardado, se muestra el guardado."""
+        distintas = [
+            (cuadro_9.at[fila, "Item"], columna, cuadro_9.at[fila, columna], self.cuadro_9.at[fila, columna])
+            for columna in cuadro_9.columns
+            if pd.api.types.is_numeric_dtype(cuadro_9[columna])
+            for fila in cuadro_9.index
+            if not _mismo_monto(cuadro_9.at[fila, columna], self.cuadro_9.at[fila, columna])
+        ]
+        if distintas:
+            self.discrepancias += distintas
+            self.cuadro_9 = cuadro_9
+
+    def _valores_origen(self, tablas_actualizacion: dict) -> dict:
+        """(fila, columna, hoja, unidad) -> valor de origen ya escalado (sin valor: no está)."""
+        valores = {hoja: _valores_actualizacion(df) for hoja, df in tablas_actualizacion.items()}
+        resultado = {}
+        for origen in self._estructura["origenes"]:
+            _, _, hoja, unidad = origen
+            valor = valores.get(hoja, {}).get(unidad)
+            if valor is not None and not pd.isna(valor):
+                resultado[origen] = valor / ESCALA_CONSOLIDADO
+        return resultado
+
+    def _recalcular_consolidado(self, tablas_actualizacion: dict) -> dict:
+        """Aplica los valores de origen que cambiaron; retorna bloque -> columnas modificadas."""
+        cambios = {}
+        for (fila, columna, _, _), valor in self._valores_origen(tablas_actualizacion).items():
+            if not _mismo_monto(self.consolidado.at[fila, columna], valor):
+                cambios.setdefault(fila, {})[columna] = valor
+        if not cambios:
+            return {}
+        self.consolidado, bloques_modificados = self._propagar(self.consolidado, cambios)
+        return bloques_modificados
+
+    def _propagar(self, consolidado: pd.DataFrame, cambios: dict) -> tuple[pd.DataFrame, dict]:
+        """
+        Copia de 'consolidado' con 'cambios' (fila -> {columna: valor}) aplicados
+        y propagados a las columnas derivadas, los totales de bloque y el resumen.
+        Retorna (consolidado, bloque -> columnas modificadas).
+        """
+        if not cambios:
+            return consolidado, {}
+        df = consolidado.copy()
+        estructura = self._estructura
+        bloques_modificados = {}
+        for fila, nuevos in cambios.items():
+            columnas = set(nuevos)
+            for columna, valor in nuevos.items():
+                df.at[fila, columna] = valor
+            for derivada, entradas in COLUMNAS_DERIVADAS_CONSOLIDADO.items():
+                if columnas.intersection(entradas):
+                    df.at[fila, derivada] = df.loc[fila, entradas].sum()
+                    columnas.add(derivada)
+            bloques_modificados.setdefault(estructura["fila_bloque"][fila], set()).update(columnas)
+            self.celdas_recalculadas += len(columnas)
+
+        columnas_total = set()
+        for bloque, columnas in bloques_modificados.items():
+            fila_total, filas = estructura["bloques"][bloque]
+            df.loc[fila_total, list(columnas)] = df.loc[filas, list(columnas)].sum()
+            columnas_total |= columnas
+
+        resumen = estructura["resumen"]
+        if "Total del Presupuesto" in resumen:
+            columnas = list(columnas_total)
+            filas_total = [fila for fila, _ in estructura["bloques"].values()]
+            fila_total = resumen["Total del Presupuesto"]
+            df.loc[fila_total, columnas] = df.loc[filas_total, columnas].sum()
+            # Sus columnas calculadas salen de la propia fila, como en las demás
+            # (no de sumar los totales de bloque)
+            for derivada, entradas in COLUMNAS_DERIVADAS_CONSOLIDADO.items():
+                if derivada in columnas_total:
+                    df.at[fila_total, derivada] = df.loc[fila_total, entradas].sum()
+            _aplicar_formulas(df, resumen, FILAS_RESUMEN_CONSOLIDADO, columnas)
+            self.celdas_recalculadas += len(columnas) * (1 + len(FILAS_RESUMEN_CONSOLIDADO))
+        return df, bloques_modificados
+
+    def _recalcular_cuadro_9(self, bloques: list):
+        """Recalcula las columnas de 'bloques' del cuadro 9, su total y participación."""
+        df = self.cuadro_9.copy()
+        filas = dict(zip(_etiquetas(df["Item"]), df.index))
+        totales = self._estructura["bloques"]
+        columnas_vp = [col for col in df.columns if col in totales]
+        columnas = [bloque for bloque in bloques if bloque in columnas_vp]
+
+        for item, columna in FILAS_CUADRO_9.items():
+            if item in filas and columna in self.consolidado.columns:
+                for bloque in columnas:
+                    df.at[filas[item], bloque] = self.consolidado.at[totales[bloque][0], columna]
+        filas_datos = [filas[item] for item in [*FILAS_CUADRO_9, "Aprobado 2024"] if item in filas]
+        df.loc[filas_datos, "Total"] = df.loc[filas_datos, columnas_vp].sum(axis=1)
+        _aplicar_formulas(df, filas, FORMULAS_CUADRO_9, columnas + ["Total"])
+
+        if "Total 2025" in filas:
+            participacion = [filas[item] for item in FILAS_PARTICIPACION_CUADRO_9 if item in filas]
+            df.loc[participacion, "%"] = df.loc[participacion, "Total"] / df.at[filas["Total 2025"], "Total"]
+        self.celdas_recalculadas += len(df) * (len(columnas) + 2)
+        self.cuadro_9 = df
+
+
+########################################
+# 6) Recálculo por línea de comandos
+########################################
+# Tablas derivadas que el recálculo guarda en el almacén (como la app)
+TABLAS_DERIVADAS = [*HOJAS_ACTUALIZACION, "consolidado_df", "cuadro_9"]
+
+
+def recalcular_derivadas(almacen) -> tuple[dict[str, pd.DataFrame], list]:
+    """
+    Recalcula desde el almacén todas las tablas derivadas, en el mismo orden
+    que el grafo de tablas de la app: tablas de área con sus esquemas ->
+    matriz de totales -> tablas de actualización -> consolidado y cuadro 9.
+    El consolidado guardado se verifica antes contra las tablas de
+    actualización persistidas (ver MotorConsolidado).
+    Retorna ({clave: DataFrame} con las tablas de área ya calculadas,
+    [discrepancias del consolidado]).
+    """
+    claves = list(TABLAS_TOTALES) + ["com", "gastos_centralizados", "dpp_metas",
+                                     *HOJAS_ACTUALIZACION, "consolidado_df", "cuadro_9"]
+    tablas = cargar_tablas(claves, almacen)
+
+    persistidas = {hoja: tablas[hoja] for hoja in HOJAS_ACTUALIZACION}
+
+    matriz = calcular_matriz_totales({clave: tablas[clave] for clave in TABLAS_TOTALES})
+    tablas["actualizacion_misiones"], tablas["actualizacion_consultorias"] = conciliar_actualizacion(
+        matriz,
+        metas_desde_tabla(tablas["dpp_metas"]),
+        TABLAS_TOTALES,
+        tablas["actualizacion_misiones"],
+        tablas["actualizacion_consultorias"],
+    )
+    motor = MotorConsolidado()
+    tablas["consolidado_df"], tablas["cuadro_9"] = motor.actualizar(
+        tablas["consolidado_df"],
+        tablas["cuadro_9"],
+        {hoja: tablas[hoja] for hoja in HOJAS_ACTUALIZACION},
+        fuentes_base={hoja: df if not df.empty else tablas[hoja] for hoja, df in persistidas.items()},
+    )
+
+    esquemas = {**TABLAS_TOTALES, "com": "com", "gastos_centralizados": "gastos_centralizados"}
+    for clave, esquema in esquemas.items():
+        if esquema and not tablas[clave].empty:
+            tablas[clave] = evaluar_esquema(tablas[clave], esquema)
+    return tablas, motor.discrepancias
+
+
+def guardar_derivadas(almacen, tablas: dict, diario: DiarioCambios=None) -> list:
+    """
+    Escribe en el almacén las tablas de TABLAS_DERIVADAS que difieren de lo
+    persistido (como los nodos "actualizacion" y "consolidado" de la app),
+    verificando que nadie las haya modificado mientras tanto.
+    Retorna las hojas escritas.
+    """
+    hojas = {clave: HOJAS_EXCEL[clave] for clave in TABLAS_DERIVADAS if tablas.get(clave) is not None}
+    persistidas = almacen.leer_hojas(list(hojas.values()))
+    reemplazos, filas = cambios_tablas(
+        {hoja: tablas[clave] for clave, hoja in hojas.items()}, persistidas
+    )
+    if not reemplazos and not filas:
+        return []
+    versiones = {hoja: huella_contenido(df) for hoja, df in persistidas.items() if hoja in {**reemplazos, **filas}}
+    almacen.escribir(reemplazos, filas, versiones)
+    if diario is not None:
+        autor = {"usuario": "recalculo", "area": None}
+        diario.registrar(reemplazos, filas, {hoja: autor for hoja in [*reemplazos, *filas]})
+    return sorted([*reemplazos, *filas])
+
+
+# Hojas que la app espera y que un libro anterior puede no tener: se crean
+# con su contenido inicial (migrar_hojas / --migrar)
+HOJAS_INICIALES = {
+    "dpp_metas":        tabla_metas_iniciales,
+    "filas_destacadas": tabla_filas_destacadas_iniciales,
+}
+
+
+def migrar_hojas(almacen, diario: DiarioCambios=None) -> list:
+    """
+    Crea en el almacén las hojas de HOJAS_INICIALES que no existen, con su
+    contenido inicial. Las que ya existen no se tocan (aunque se hayan editado).
+    Se escribe a través del almacén, como cualquier guardado de la app.
+    Retorna las hojas creadas.
+    """
+    hojas = {HOJAS_EXCEL[clave]: crear for clave, crear in HOJAS_INICIALES.items()}
+    existentes = almacen.leer_hojas(list(hojas))
+    nuevas = {hoja: crear() for hoja, crear in hojas.items() if hoja not in existentes}
+    if not nuevas:
+        return []
+    # Versión esperada None: falla si otro proceso creó la hoja mientras tanto
+    almacen.escribir(nuevas, versiones_esperadas={hoja: None for hoja in nuevas})
+    if diario is not None:
+        autor = {"usuario": "migracion", "area": None}
+        diario.registrar(nuevas, {}, {hoja: autor for hoja in nuevas})
+    return sorted(nuevas)
+
+
+def escribir_libro(tablas: dict, ruta: str):
+    """Escribe 'tablas' ({clave: DataFrame}) en un libro nuevo, una hoja por tabla."""
+    with pd.ExcelWriter(ruta, engine="openpyxl") as writer:
+        for clave, df in tablas.items():
+            df.to_excel(writer, sheet_name=HOJAS_EXCEL[clave], index=False)
+
+
+def main(argv=None) -> int:
+    """
+    Recalcula las tablas derivadas sin la interfaz, p.ej. desde cron:
+
+        python presupuesto_nucleo.py --salida derivadas.xlsx
+        python presupuesto_nucleo.py --almacen sqlite --sin-guardar --salida simulacion.xlsx
+
+    Con --migrar solo crea las hojas de HOJAS_INICIALES que falten (p.ej.
+    'dpp_metas' o 'filas_destacadas' en un libro anterior) y termina.
+    """
+    parser = argparse.ArgumentParser(
+        description="Recalcula las tablas de actualización y el consolidado a partir del almacén."
+    )
+    parser.add_argument("--almacen", choices=["excel", "sqlite"], default=BACKEND_ALMACEN,
+                        help="backend del almacén (por defecto PRESUPUESTO_ALMACEN)")
+    parser.add_argument("--excel", default=EXCEL_FILE, help="libro del almacén Excel")
+    parser.add_argument("--sqlite", default=SQLITE_FILE, help="base del almacén SQLite")
+    parser.add_argument("--salida", help="libro .xlsx donde escribir todas las tablas recalculadas")
+    parser.add_argument("--sin-guardar", action="store_true",
+                        help="no escribir las tablas derivadas en el almacén")
+    parser.add_argument("--migrar", action="store_true",
+                        help="crear las hojas que falten (dpp_metas, filas_destacadas) con su contenido inicial y terminar")
+    args = parser.parse_args(argv)
+
+    almacen = crear_almacen(args.almacen, args.excel, args.sqlite)
+    if args.migrar:
+        try:
+            creadas = migrar_hojas(almacen, DiarioCambios(DIARIO_DIR, almacen) if DIARIO_DIR else None)
+        except ConflictoVersionError as e:
+            print(f"No se migró: {e}", file=sys.stderr)
+            return 1
+        print(f"Hojas creadas en el almacén: {', '.join(creadas) if creadas else 'ninguna (ya existían)'}")
+        return 0
+    inicio = time.time()
+    tablas, discrepancias = recalcular_derivadas(almacen)
+    print(f"Tablas recalculadas en {time.time() - inicio:.2f} s")
+    for fila, columna, guardado, derivado in discrepancias:
+        print(f"Consolidado sin derivar, no coincide con su origen: {fila} / {columna} "
+              f"(libro {guardado}, origen {derivado})", file=sys.stderr)
+
+    if not args.sin_guardar:
+        try:
+            diario = DiarioCambios(DIARIO_DIR, almacen) if DIARIO_DIR else None
+            escritas = guardar_derivadas(almacen, tablas, diario)
+        except ConflictoVersionError as e:
+            print(f"No se guardó: {e}", file=sys.stderr)
+            return 1
+        print(f"Hojas actualizadas en el almacén: {', '.join(escritas) if escritas else 'ninguna (sin cambios)'}")
+    if args.salida:
+        escribir_libro(tablas, args.salida)
+        print(f"Tablas escritas en {args.salida}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())